@@ -1,14 +1,20 @@
 import tensorflow as tf
 import os
+import json
+import tempfile
+import itertools
 import random
 import ssbm
 import ctypes
 import tf_lib as tfl
 import util
 import ctype_util as ct
+import snapshot
 import numpy as np
 import embed
 from default import *
+import model_options
+from model_options import RLConfig
 from dqn import DQN
 from ac import ActorCritic
 #from thompson_dqn import ThompsonDQN
@@ -29,28 +35,61 @@ models = [
 ]
 models = {model.__name__ : model for model in models}
 
-class RLConfig(Default):
-  _options = [
-    Option('tdN', type=int, default=5, help="use n-step TD error"),
-    Option('reward_halflife', type=float, default=2.0, help="time to discount rewards by half, in seconds"),
-    Option('act_every', type=int, default=3, help="Take an action every ACT_EVERY frames."),
-    Option('experience_time', type=int, default=60, help="Length of experiences, in seconds."),
-  ]
+def makeSession(graph, mode):
+  tf_config = dict(
+    allow_soft_placement=True,
+    #log_device_placement=True,
+  )
+  
+  if mode == Mode.PLAY: # don't eat up cpu cores
+    tf_config.update(
+      inter_op_parallelism_threads=1,
+      intra_op_parallelism_threads=1,
+    )
+  else:
+    tf_config.update(
+      #gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.3),
+    )
+  
+  return tf.Session(
+    graph=graph,
+    config=tf.ConfigProto(**tf_config),
+  )
+
+# the modules whose code goes into building the graph
+graphSources = ['RL.py', 'embed.py', 'tf_lib.py', 'ctype_util.py', 'ssbm.py', 'opt.py']
+
+# keyword arguments that aren't Options but still change the graph, with their defaults
+graphArgs = dict(
+  swap=False, # embed.GameEmbedding reverses the players, as for the enemy in cpu.py
+)
+
+def graphKey(model, modelType, mode, kwargs):
+  """Identifies a graph by everything that goes into building it."""
+  import inspect
+  
+  params = {}
+  for opt in itertools.chain(model.full_opts(), modelType.full_opts()):
+    value = kwargs.get(opt.name)
+    params[opt.name] = opt.default if value is None else value
+  for name, default in graphArgs.items():
+    params[name] = kwargs.get(name, default)
+  # these don't change the graph
+  for name in ['path', 'name', 'graph_cache']:
+    params.pop(name, None)
+  
+  sources = graphSources + [inspect.getsourcefile(modelType)]
+  directory = os.path.dirname(os.path.abspath(__file__))
+  code = ''
+  for source in sources:
+    with open(os.path.join(directory, os.path.basename(source))) as f:
+      code += f.read()
   
-  def __init__(self, **kwargs):
-    super(RLConfig, self).__init__(**kwargs)
-    self.fps = 60 // self.act_every
-    self.discount = 0.5 ** ( 1.0 / (self.fps*self.reward_halflife) )
-    self.experience_length = self.experience_time * self.fps
+  key = json.dumps([params, mode.name, tf.__version__, util.hashString(code)], sort_keys=True, default=str)
+  return "%s-%s" % (modelType.__name__, util.hashString(key))
 
 class Model(Default):
-  _options = [
-    Option('model', type=str, default="DQN", choices=models.keys()),
-    Option('path', type=str, help="path to saved model"),
-    Option('gpu', type=bool, default=False, help="train on gpu"),
-    Option('memory', type=int, default=0, help="number of frames to remember"),
-    Option('name', type=str)
-  ]
+  _options = model_options.Model._options
   
   _members = [
     ('rlConfig', RLConfig),
@@ -77,6 +116,18 @@ class Model(Default):
     if not self.gpu:
       os.environ['CUDA_VISIBLE_DEVICES'] = ""
     
+    self.debug = debug
+    self.meta_saved = False
+    
+    cache = None
+    if mode == Mode.PLAY and self.graph_cache:
+      cache = os.path.join(self.graph_cache, graphKey(self, modelType, mode, kwargs))
+      if os.path.exists(cache + '.meta'):
+        print("Importing cached graph", cache)
+        self.import_graph(cache, modelType, **kwargs)
+        self.sess = makeSession(self.graph, mode)
+        return
+    
     with self.graph.as_default(), tf.device(device):
       self._init_members(**kwargs)
       
@@ -99,11 +150,37 @@ class Model(Default):
           #self.experience['initial'] = tuple(tf.placeholder(tf.float32, [None, size], name='experience/initial/%d' % i) for i, size in enumerate(self.model.hidden_size))
           self.experience['initial'] = util.deepMap(lambda size: tf.placeholder(tf.float32, [None, size], name="experience/initial"), self.model.hidden_size)
           
-          mean_reward = tf.reduce_mean(self.experience['reward'])
+          # importance sampling weights for prioritized replay, otherwise all ones
+          self.experience_weights = tf.placeholder(tf.float32, [None], name='experience/weight')
+          
+          experience = self.experience
+          weights = self.experience_weights
           
-          states = self.embedGame(self.experience['state'])
+          if self.resident_batch:
+            # Copies of the inputs that live on the device. They are only (re)initialized
+            # by load_batch, so repeated steps on one batch don't feed anything.
+            # Collected as they're made, since deepValues doesn't look inside the
+            # tuples of a recurrent model's initial state.
+            residents = []
+            def makeResident(placeholder):
+              var = tf.Variable(placeholder, trainable=False, validate_shape=False, collections=[])
+              residents.append(var)
+              return var
+            
+            def read(var):
+              value = var.value()
+              value.set_shape(var.initial_value.get_shape())
+              return value
+            
+            resident = util.deepMap(makeResident, [self.experience, self.experience_weights])
+            self.load_batch = tf.group(*[var.initializer for var in residents])
+            experience, weights = util.deepMap(read, resident)
           
-          prev_actions = embed.embedAction(self.experience['prev_action'])
+          mean_reward = tf.reduce_mean(experience['reward'])
+          
+          states = self.embedGame(experience['state'])
+          
+          prev_actions = embed.embedAction(experience['prev_action'])
           states = tf.concat(2, [states, prev_actions])
           
           train_length = self.rlConfig.experience_length - self.memory
@@ -111,10 +188,10 @@ class Model(Default):
           history = [tf.slice(states, [0, i, 0], [-1, train_length, -1]) for i in range(self.memory+1)]
           self.train_states = tf.concat(2, history)
           
-          actions = embed.embedAction(self.experience['action'])
+          actions = embed.embedAction(experience['action'])
           self.train_actions = tf.slice(actions, [0, self.memory, 0], [-1, train_length, -1])
           
-          self.train_rewards = tf.slice(self.experience['reward'], [0, self.memory], [-1, -1])
+          self.train_rewards = tf.slice(experience['reward'], [0, self.memory], [-1, -1])
           
           """
           data_names = ['state', 'action', 'reward']
@@ -136,7 +213,8 @@ class Model(Default):
             states=self.train_states,
             actions=self.train_actions,
             rewards=self.train_rewards,
-            initial=self.experience['initial']
+            initial=experience['initial'],
+            weights=weights,
           )
           
           self.train_op = self.model.train(**train_args)
@@ -150,13 +228,22 @@ class Model(Default):
           
           misc = tf.group(increment)
           
-          self.run_dict = dict(summary=merged, global_step=self.global_step, train=self.train_op, misc=misc)
+          # summaries are only fetched (and so only computed) every summary_every steps
+          self.run_dict = dict(global_step=self.global_step, train=self.train_op, misc=misc)
+          self.summary_op = merged
+          self.steps_since_summary = None
+          
+          # only needed on the last step of each batch
+          self.priorities = getattr(self.model, 'priorities', None)
           
           print("Creating summary writer at logs/%s." % self.name)
           self.writer = tf.train.SummaryWriter('logs/' + self.name, self.graph)
       else:
         with tf.name_scope('policy'):
-          self.input = ct.inputCType(ssbm.SimpleStateAction, [self.memory+1], "input")
+          # the whole history is fed as one float array, see FlatLayout
+          self.layout = ct.FlatLayout(ssbm.SimpleStateAction)
+          self.flat_input = tf.placeholder(tf.float32, [self.memory+1, self.layout.size], name="input/flat")
+          self.input = self.layout.unflatten(self.flat_input)
           
           #self.input['hidden'] = [tf.placeholder(tf.float32, [size], name='input/hidden/%d' % i) for i, size in enumerate(self.model.hidden_size)]
           self.input['hidden'] = util.deepMap(lambda size: tf.placeholder(tf.float32, [size], name="input/hidden"), self.model.hidden_size)
@@ -174,37 +261,88 @@ class Model(Default):
           
           self.policy = self.model.getPolicy(**policy_args)
       
-      self.debug = debug
-      
       self.variables = tf.all_variables()
+      # in creation order, for numpy_policy
+      self.trainable_variables = tf.trainable_variables()
       
       self.saver = tf.train.Saver(self.variables)
       
       self.placeholders = {v.name : tf.placeholder(v.dtype, v.get_shape()) for v in self.variables}
       self.unblobber = tf.group(*[tf.assign(v, self.placeholders[v.name]) for v in self.variables])
       
-      tf_config = dict(
-        allow_soft_placement=True,
-        #log_device_placement=True,
-      )
+      if cache:
+        self.export_graph(cache)
+    
+    self.sess = makeSession(self.graph, mode)
+  
+  def export_graph(self, cache):
+    """Saves the play-mode graph, along with the names of the tensors import_graph needs."""
+    util.makedirs(os.path.dirname(cache))
+    
+    names = dict(
+      input=util.deepMap(lambda t: t.name, self.input),
+      flat_input=self.flat_input.name,
+      policy=util.deepMap(lambda t: t.name, self.policy),
+      global_step=self.global_step.name,
+      variables=[v.name for v in self.variables],
+      trainable_variables=[v.name for v in self.trainable_variables],
+      placeholders={k: p.name for k, p in self.placeholders.items()},
+      unblobber=self.unblobber.name,
+      # the python side of the model, so import_graph doesn't have to build it
+      action_size=self.model.action_size,
+      hidden_size=self.model.hidden_size,
+    )
+    
+    # other processes may be importing, so write to temporary files and rename
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(cache), delete=False) as f:
+      json.dump(names, f)
+    os.rename(f.name, cache + '.json')
+    
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache), delete=False) as f:
+      tempname = f.name
+    tf.train.export_meta_graph(filename=tempname, saver_def=self.saver.as_saver_def())
+    os.rename(tempname, cache + '.meta')
+  
+  def import_graph(self, cache, modelType, **kwargs):
+    """Restores a graph from export_graph instead of building it."""
+    
+    with open(cache + '.json') as f:
+      names = json.load(f)
+    
+    self.rlConfig = RLConfig(**kwargs)
+    
+    # Playing only needs model.act, which is plain python, so the model gets
+    # its options and the sizes saved by export_graph but builds no layers.
+    self.model = modelType.__new__(modelType)
+    Default.__init__(self.model, init_members=False, **kwargs)
+    self.model.rlConfig = self.rlConfig
+    self.model.action_size = names['action_size']
+    self.model.hidden_size = names['hidden_size']
+    
+    with self.graph.as_default():
+      self.saver = tf.train.import_meta_graph(cache + '.meta')
       
-      if mode == Mode.PLAY: # don't eat up cpu cores
-        tf_config.update(
-          inter_op_parallelism_threads=1,
-          intra_op_parallelism_threads=1,
-        )
-      else:
-        tf_config.update(
-          #gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.3),
-        )
+      tensor = self.graph.get_tensor_by_name
+      variables = {v.name: v for v in tf.all_variables()}
+      
+      self.layout = ct.FlatLayout(ssbm.SimpleStateAction)
+      self.flat_input = tensor(names['flat_input'])
+      self.input = util.deepMap(tensor, names['input'])
+      self.policy = util.deepMap(tensor, names['policy'])
+      
+      self.global_step = variables[names['global_step']]
+      self.variables = [variables[name] for name in names['variables']]
+      self.trainable_variables = [variables[name] for name in names['trainable_variables']]
       
-      self.sess = tf.Session(
-        graph=self.graph,
-        config=tf.ConfigProto(**tf_config),
-      )
+      self.placeholders = {k: tensor(name) for k, name in names['placeholders'].items()}
+      self.unblobber = self.graph.get_operation_by_name(names['unblobber'])
+    
+    self.meta_saved = True
 
-  def act(self, history, verbose=False):
-    feed_dict = dict(util.deepValues(util.deepZip(self.input, history)))
+  def act_flat(self, history, hidden, verbose=False):
+    """history is the output of self.layout.flatten."""
+    feed_dict = dict(util.deepValues(util.deepZip(self.input['hidden'], hidden)))
+    feed_dict[self.flat_input] = history
     return self.model.act(self.sess.run(self.policy, feed_dict), verbose)
 
   #summaryWriter = tf.train.SummaryWriter('logs/', sess.graph)
@@ -240,12 +378,26 @@ class Model(Default):
     # if step_index == 10:
     import ipdb; ipdb.set_trace()
 
-  def train(self, experiences, batch_steps=1, **kwargs):
-    experiences = util.deepZip(*experiences)
-    experiences = util.deepMap(np.array, experiences)
+  def prepare(self, experiences, weights=None):
+    """Builds the feed dict for a training step. Takes either a list of
+    experiences, or a batch already stacked into arrays (as from
+    replay.ReplayBuffer). Safe to call from other threads."""
+    if not isinstance(experiences, dict):
+      experiences = util.deepZip(*experiences)
+      experiences = util.deepMap(np.array, experiences)
     
     input_dict = dict(util.deepValues(util.deepZip(self.experience, experiences)))
     
+    if weights is None:
+      weights = np.ones(len(experiences['action']), dtype=np.float32)
+    input_dict[self.experience_weights] = weights
+    
+    return input_dict
+  
+  def run(self, input_dict, batch_steps=1):
+    """Takes batch_steps gradient steps on a prepared feed dict.
+    
+    Returns the per-experience priorities from the last step, if the model has them."""
     """
     saved_data = self.sess.run(self.saved_data, input_dict)
     handles = [t.handle for t in saved_data]
@@ -256,28 +408,83 @@ class Model(Default):
     if self.debug:
       self.debugGrads(input_dict)
     
-    for _ in range(batch_steps):
+    if self.resident_batch:
+      self.sess.run(self.load_batch, input_dict)
+      input_dict = {}
+    
+    for step in range(batch_steps):
+      fetches = dict(self.run_dict)
+      
+      summarize = self.steps_since_summary is None or self.steps_since_summary + 1 >= self.summary_every
+      if summarize:
+        fetches.update(summary=self.summary_op)
+      
+      if self.priorities is not None and step == batch_steps - 1:
+        fetches.update(priorities=self.priorities)
+      
       try:
-        results = self.sess.run(self.run_dict, input_dict)
+        results = self.sess.run(fetches, input_dict)
       except tf.errors.InvalidArgumentError as e:
         import pickle
         with open(self.path + 'error', 'wb') as f:
-          pickle.dump(experiences, f)
+          pickle.dump({k.name: v for k, v in input_dict.items()}, f)
         raise e
       
-      summary_str = results['summary']
-      global_step = results['global_step']
-      self.writer.add_summary(summary_str, global_step)
+      if summarize:
+        self.writer.add_summary(results['summary'], results['global_step'])
+        self.steps_since_summary = 0
+      else:
+        self.steps_since_summary += 1
+    
+    return results.get('priorities')
+  
+  def train(self, experiences, batch_steps=1, weights=None, **kwargs):
+    return self.run(self.prepare(experiences, weights), batch_steps)
 
   def save(self):
     import os
     util.makedirs(self.path)
     print("Saving to", self.path)
-    self.saver.save(self.sess, self.path + "snapshot")
+    
+    # the graph doesn't change, so only write the meta graph once
+    self.saver.save(self.sess, self.path + "snapshot", write_meta_graph=not self.meta_saved)
+    self.meta_saved = True
+    
+    # the raw snapshot is what agents restore from, see write_blob
+    self.write_blob(self.blob(), int(self.sess.run(self.global_step)))
 
+  def write_blob(self, blob, step, keep=5):
+    """Writes a blob as the latest raw snapshot, keeping the last keep versions (at least this one).
+    
+    Doesn't touch the session, so it can run on another thread while training continues.
+    """
+    util.makedirs(self.path)
+    
+    names = [v.name for v in self.trainable_variables]
+    with tempfile.NamedTemporaryFile('w', dir=self.path, delete=False) as f:
+      json.dump(names, f)
+    os.rename(f.name, self.path + "snapshot.vars")
+    
+    versioned = "%ssnapshot-%d.raw" % (self.path, step)
+    snapshot.writeRaw(versioned, blob)
+    
+    # snapshot.raw is a hard link to the latest version
+    link = versioned + ".link"
+    os.link(versioned, link)
+    os.rename(link, self.path + "snapshot.raw")
+    
+    # by age rather than step, as the step goes back down after --init
+    versions = [old for old in snapshot.rawVersions(self.path) if old != versioned]
+    for old in versions[:max(len(versions) - (keep - 1), 0)]:
+      os.remove(old)
+  
   def restore(self):
     print("Restoring from", self.path)
-    self.saver.restore(self.sess, self.path + "snapshot")
+    if snapshot.latestSnapshot(self.path) == 'raw':
+      # just a memory map and one assign op
+      self.unblob(snapshot.loadRaw(self.path + "snapshot.raw"))
+    else:
+      self.saver.restore(self.sess, self.path + "snapshot")
 
   def init(self):
     with self.graph.as_default():
@@ -290,5 +497,37 @@ class Model(Default):
       return {var.name: val for var, val in zip(self.variables, values)}
   
   def unblob(self, blob):
-    self.sess.run(self.unblobber, {self.placeholders[k]: v for k, v in blob.items()})
+    # blobs from the trainer also have variables (such as optimizer state) that aren't needed to play
+    self.sess.run(self.unblobber, {self.placeholders[k]: v for k, v in blob.items() if k in self.placeholders})
+
+
+def benchmarkStartup(trials=3, graph_cache="graph_cache/", **kwargs):
+  """Times building a play-mode Model from python against importing it from the graph cache."""
+  import time
+  
+  # make sure the cache is populated before timing it
+  Model(mode=Mode.PLAY, graph_cache=graph_cache, **kwargs)
+  
+  for label, cache in [('uncached', None), ('cached', graph_cache)]:
+    start = time.time()
+    for _ in range(trials):
+      Model(mode=Mode.PLAY, graph_cache=cache, **kwargs)
+    print("%s: %.3fs per model" % (label, (time.time() - start) / trials))
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+  parser = ArgumentParser()
+
+  for opt in Model.full_opts():
+    opt.update_parser(parser)
+
+  for model in models.values():
+    for opt in model.full_opts():
+      opt.update_parser(parser)
+
+  parser.add_argument("--trials", type=int, default=3)
 
+  args = parser.parse_args()
+  args = {k: v for k, v in args.__dict__.items() if v is not None}
+  args.setdefault('graph_cache', "graph_cache/")
+  benchmarkStartup(**args)
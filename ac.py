@@ -3,22 +3,13 @@ import tf_lib as tfl
 import util
 from numpy import random
 from default import *
+import model_options
 import opt
 
 class ActorCritic(Default):
   hidden_size = []  
   
-  _options = [
-    Option('actor_layers', type=int, nargs='+', default=[128, 128]),
-    Option('critic_layers', type=int, nargs='+', default=[128, 128]),
-
-    Option('epsilon', type=float, default=0.02),
-
-    Option('entropy_scale', type=float, default=0.001),
-    Option('policy_scale', type=float, default=0.1),
-    
-    Option('kl_scale', type=float, default=1.0, help="kl divergence weight in natural metric"),
-  ]
+  _options = model_options.ActorCritic._options
 
   _members = [
     ('optimizer', opt.Optimizer)
@@ -49,7 +40,7 @@ class ActorCritic(Default):
 
     self.rlConfig = rlConfig
 
-  def train(self, states, actions, rewards, **unused):
+  def train(self, states, actions, rewards, weights=None, **unused):
     n = self.rlConfig.tdN
     
     state_shape = tf.shape(states)
@@ -74,7 +65,13 @@ class ActorCritic(Default):
     targets = tf.stop_gradient(targets)
 
     advantages = targets - trainVs
-    vLoss = tf.reduce_mean(tf.square(advantages))
+    # for prioritized replay
+    self.priorities = tf.reduce_mean(tf.abs(advantages), 1)
+    
+    # importance sampling weights, one per experience
+    weights = 1. if weights is None else tf.expand_dims(weights, 1)
+    
+    vLoss = tf.reduce_mean(weights * tf.square(advantages))
     tf.scalar_summary('v_loss', vLoss)
     
     variance = tf.reduce_mean(tf.squared_difference(targets, tf.reduce_mean(targets)))
@@ -86,7 +83,7 @@ class ActorCritic(Default):
     
     real_log_actor_probs = tfl.batch_dot(actions, log_actor_probs)
     train_log_actor_probs = tf.slice(real_log_actor_probs, [0, 0], [-1, train_length])
-    actor_gain = tf.reduce_mean(tf.mul(train_log_actor_probs, tf.stop_gradient(advantages)))
+    actor_gain = tf.reduce_mean(weights * tf.mul(train_log_actor_probs, tf.stop_gradient(advantages)))
     tf.scalar_summary('actor_gain', actor_gain)
     
     acLoss = vLoss - self.policy_scale * (actor_gain + self.entropy_scale * actor_entropy)
@@ -1,13 +1,13 @@
-import tensorflow as tf
 import ssbm
-import tf_lib as tfl
 import numpy as np
 from numpy import random, exp
-import RL
 import util
 from default import *
 from menu_manager import characters
 import ctype_util as ct
+import model_options
+import numpy_policy
+import weights
 import pprint
 
 pp = pprint.PrettyPrinter(indent=2)
@@ -18,25 +18,42 @@ class Agent(Default):
     Option('char', type=str, choices=characters.keys(), help="character that this agent plays as"),
     Option('verbose', action="store_true", default=False, help="print stuff while running"),
     Option('reload', type=int, default=60, help="reload model every RELOAD seconds"),
+    Option('numpy', action="store_true", default=False, help="act with numpy_policy instead of a tf session"),
+    Option('subscribe', type=str, help="ip of a trainer to receive weights from, instead of reloading them from disk"),
   ]
   
   _members = [
-    ('model', RL.Model)
+    ('model', model_options.Model)
   ]
   
   def __init__(self, **kwargs):
-    kwargs = kwargs.copy()
-    kwargs.update(mode=RL.Mode.PLAY)
-    Default.__init__(self, **kwargs)
+    Default.__init__(self, init_members=False, **kwargs)
+    
+    # only the tf version of the model needs tensorflow
+    if self.numpy:
+      self.model = numpy_policy.Policy(**kwargs)
+    else:
+      import RL
+      kwargs = kwargs.copy()
+      kwargs.update(mode=RL.Mode.PLAY)
+      self.model = RL.Model(**kwargs)
+    
+    # the numpy policy only builds its model once it has weights
+    self.model.restore()
     
     self.counter = 0
     self.action = 0
     self.actions = util.CircularQueue(self.delay+1, 0)
     self.memory = util.CircularQueue(array=((self.model.memory+1) * ssbm.SimpleStateAction)())
+    self.history = np.zeros([self.model.memory+1, self.model.layout.size], dtype=np.float32)
     
     self.hidden = util.deepMap(np.zeros, self.model.model.hidden_size)
     
-    self.model.restore()
+    # with a subscriber, new weights arrive on their own instead of being reloaded
+    self.subscriber = None
+    if self.subscribe:
+      self.subscriber = weights.WeightSubscriber(self.subscribe, self.model.name, self.model.unblob)
+      self.subscriber.start()
 
   def act(self, state, pad):
     verbose = self.verbose and (self.counter % (10 * self.model.rlConfig.fps) == 0)
@@ -49,12 +66,9 @@ class Agent(Default):
     current.prev_action = self.prev_action
 
     self.memory.increment()
-    history = self.memory.as_list()
-    
-    history = ct.vectorizeCTypes(ssbm.SimpleStateAction, history)
-    history['hidden'] = self.hidden
+    history = self.model.layout.flatten(self.memory.array, self.memory.index, self.history)
     
-    self.action, self.hidden = self.model.act(history, verbose)
+    self.action, self.hidden = self.model.act_flat(history, self.hidden, verbose)
     
     current.action = self.action
 
@@ -76,11 +90,10 @@ class Agent(Default):
     if self.char in ['zelda', 'sheik'] and action in [18, 21, 24]:
       action = 4
 
-    controller = ssbm.simpleControllerStates[action]
-    pad.send_controller(controller.realController())
+    pad.send_action(ssbm.actionTable, action)
 
     self.counter += 1
 
-    if self.reload and self.counter % (self.reload * self.model.rlConfig.fps) == 0:
+    if self.reload and not self.subscriber and self.counter % (self.reload * self.model.rlConfig.fps) == 0:
       self.model.restore()
 
@@ -1,16 +1,13 @@
 import tensorflow as tf
 from default import *
+import model_options
 import tf_lib as tfl
 
 def mag2(x):
   return tf.reduce_sum(tf.square(x))
 
 class ConjugateGradient(Default):
-  _options = [
-    Option('cg_iters', type=int, default=10, help="Maximum number of conjugate gradient iterations."),
-    Option('residual_tol', type=float, default=1e-10, help="Minimum conjugate gradient residual tolerance."),
-    Option('cg_damping', type=float, default=1e-4, help="Add a multiple of the identity function during conjugate gradient descent."),
-  ]
+  _options = model_options.ConjugateGradient._options
   
   def __call__(self, f_Ax, b, debug=False):
     """
@@ -4,13 +4,13 @@ import state_manager
 import memory_watcher
 from menu_manager import *
 import os
+import sys
 from pad import *
 import time
 import fox
 import agent
 import util
 from ctype_util import copy
-import RL
 from numpy import random
 from reward import computeRewards
 import movie
@@ -20,8 +20,13 @@ class CPU(Default):
     _options = [
       Option('tag', type=int),
       Option('dump', type=str, help="dump experiences to ip address via zmq"),
+      Option('dump_format', type=str, default="binary", choices=["binary", "compressed", "pickle"], help="how to send experiences to the trainer"),
       Option('user', type=str, help="dolphin user directory"),
       Option('zmq', type=bool, default=True, help="use zmq for memory watcher"),
+      Option('coalesce', type=bool, default=True, help="only send changed pad inputs, in one write per frame"),
+      Option('binary', action="store_true", default=False, help="memory watcher sends the binary diff format"),
+      Option('drain', type=bool, default=True, help="read whole frames at once from the non-zmq memory watcher; a frame is only complete once the next one starts, so this adds a frame of latency"),
+      Option('compiled_sm', type=bool, default=True, help="use the precompiled StateManager dispatch table"),
       Option('stage', type=str, default="final_destination", choices=movie.stages.keys(), help="which stage to play on"),
       Option('enemy', type=str, help="load enemy agent from file"),
       Option('enemy_reload', type=int, default=0, help="enemy reload interval"),
@@ -65,7 +70,10 @@ class CPU(Default):
 
         self.state = ssbm.GameMemory()
         # track players 1 and 2 (pids 0 and 1)
-        self.sm = state_manager.StateManager([0, 1])
+        smType = state_manager.StateManager
+        if self.compiled_sm:
+          smType = state_manager.CompiledStateManager
+        self.sm = smType([0, 1])
         self.write_locations()
 
         if self.tag is not None:
@@ -94,17 +102,28 @@ class CPU(Default):
         self.menu_managers = {i: MenuManager(characters[c], pid=i) for i, c in self.characters.items()}
 
         print('Creating MemoryWatcher.')
-        mwType = memory_watcher.MemoryWatcher
-        if self.zmq:
-          mwType = memory_watcher.MemoryWatcherZMQ
-        self.mw = mwType(self.user + '/MemoryWatcher/MemoryWatcher')
+        mw_path = self.user + '/MemoryWatcher/MemoryWatcher'
+        # decode whole zmq messages into arrays and apply them in one go
+        self.batched = self.zmq and self.compiled_sm
+        if self.binary:
+          if not self.batched:
+            sys.exit("The binary memory watcher needs --zmq and --compiled_sm")
+          self.mw = memory_watcher.MemoryWatcherBinary(mw_path)
+        elif self.batched:
+          self.mw = memory_watcher.MemoryWatcherZMQ(mw_path, ids=self.sm.ids)
+        elif self.zmq:
+          self.mw = memory_watcher.MemoryWatcherZMQ(mw_path)
+        elif self.drain:
+          self.mw = memory_watcher.MemoryWatcher(mw_path, frames=True)
+        else:
+          self.mw = memory_watcher.MemoryWatcher(mw_path)
         
         pipe_dir = self.user + '/Pipes/'
         print('Creating Pads at %s. Open dolphin now.' % pipe_dir)
         util.makedirs(self.user + '/Pipes/')
         
         paths = [pipe_dir + 'phillip%d' % i for i in self.pids]
-        self.get_pads = util.async_map(Pad, paths)
+        self.get_pads = util.async_map(lambda path: Pad(path, coalesce=self.coalesce), paths)
 
         self.init_stats()
         
@@ -175,10 +194,20 @@ class CPU(Default):
             
             print("Dumping", self.dump_count)
             
-            prepared = ssbm.prepareStateActions(self.dump_state_actions)
-            prepared['initial'] = self.initial
-            
-            self.socket.send_pyobj(prepared)
+            if self.dump_format == "pickle":
+                prepared = ssbm.prepareStateActions(self.dump_state_actions)
+                prepared['initial'] = self.initial
+                
+                self.socket.send_pyobj(prepared)
+            elif self.dump_format == "compressed":
+                # encoding copies the states, so the buffer can be reused
+                frames = ssbm.packExperience(self.dump_state_actions, self.initial, ssbm.COMPRESSED)
+                self.socket.send_multipart(frames)
+            else:
+                frames = ssbm.packExperience(self.dump_state_actions, self.initial)
+                self.socket.send_multipart(frames, copy=False)
+                # zmq may still be reading the old buffer
+                self.dump_state_actions = (self.dump_size * ssbm.SimpleStateAction)()
 
     def advance_frame(self):
         last_frame = self.state.frame
@@ -194,6 +223,8 @@ class CPU(Default):
 
             start = time.time()
             self.make_action()
+            for pad in self.pads:
+                pad.flush()
             self.thinking_time += time.time() - start
 
             if self.state.frame % (15 * 60) == 0:
@@ -202,6 +233,10 @@ class CPU(Default):
         self.mw.advance()
 
     def update_state(self):
+        if self.batched:
+          self.sm.handle_diffs(self.state, self.mw.get_diffs())
+          return
+        
         messages = self.mw.get_messages()
         for message in messages:
           self.sm.handle(self.state, *message)
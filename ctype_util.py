@@ -3,7 +3,6 @@ from enum import IntEnum
 from itertools import product
 import numpy as np
 from numpy import random
-import tensorflow as tf
 
 def copy(src, dst):
     """Copies the contents of src to dst"""
@@ -92,16 +91,18 @@ def randomValue(ctype):
   raise TypeError("Unsupported type %s" % ctype)
 
 # TODO: fill out the rest of this table
+# dtype names, so that tensorflow is only imported by the functions that build graphs
 ctypes2TF = {
-  c_bool : tf.bool,
-  c_float : tf.float32,
-  c_double : tf.float64,
-  c_uint : tf.int64, # no tf.uint32 :(
+  c_bool : 'bool',
+  c_float : 'float32',
+  c_double : 'float64',
+  c_uint : 'int64', # no tf.uint32 :(
 }
 
 def inputCType(ctype, shape=None, name=""):
   if ctype in ctypes2TF:
-    return tf.placeholder(ctypes2TF[ctype], shape, name)
+    import tensorflow as tf
+    return tf.placeholder(tf.as_dtype(ctypes2TF[ctype]), shape, name)
   elif issubclass(ctype, Structure):
     return {f : inputCType(t, shape, name + "/" + f) for (f, t) in ctype._fields_}
   else: # assume an array type
@@ -110,7 +111,8 @@ def inputCType(ctype, shape=None, name=""):
 
 def constantCTypes(ctype, values, name=""):
   if ctype in ctypes2TF:
-    return tf.constant(values, dtype=ctypes2TF[ctype], name=name)
+    import tensorflow as tf
+    return tf.constant(values, dtype=tf.as_dtype(ctypes2TF[ctype]), name=name)
   elif issubclass(ctype, Structure):
     return {f : constantCTypes(t, [getattr(v, f) for v in values], name + "/" + f) for (f, t) in ctype._fields_}
   else: # assume an array type
@@ -156,3 +158,158 @@ def vectorizeCTypes(ctype, values):
     base_type = ctype._type_
     return [vectorizeCTypes(base_type, [v[i] for v in values]) for i in range(ctype._length_)]
 
+numpyCTypes = {
+  c_bool : np.bool_,
+  c_float : np.float32,
+  c_double : np.float64,
+  c_uint : np.uint32,
+  c_int : np.int32,
+}
+
+dtypeCache = {}
+
+def toDType(ctype):
+  """Returns a numpy dtype with exactly the memory layout of ctype."""
+  if ctype in dtypeCache:
+    return dtypeCache[ctype]
+  
+  if ctype in numpyCTypes:
+    dtype = np.dtype(numpyCTypes[ctype])
+  elif issubclass(ctype, Structure):
+    dtype = np.dtype(dict(
+      names=[f for f, _ in ctype._fields_],
+      formats=[toDType(t) for _, t in ctype._fields_],
+      offsets=[getattr(ctype, f).offset for f, _ in ctype._fields_],
+      itemsize=sizeof(ctype),
+    ))
+  else: # assume an array type
+    dtype = np.dtype((toDType(ctype._type_), (ctype._length_,)))
+  
+  dtypeCache[ctype] = dtype
+  return dtype
+
+def splitView(ctype, view):
+  if ctype in numpyCTypes:
+    return view
+  elif issubclass(ctype, Structure):
+    return {f : splitView(t, view[f]) for (f, t) in ctype._fields_}
+  else: # assume an array type
+    return [splitView(ctype._type_, view[..., i]) for i in range(ctype._length_)]
+
+def leafViews(ctype, view):
+  """Yields the leaves of splitView, in the same order as leafFields."""
+  if ctype in numpyCTypes:
+    yield view
+  elif issubclass(ctype, Structure):
+    for f, t in ctype._fields_:
+      yield from leafViews(t, view[f])
+  else: # assume an array type
+    for i in range(ctype._length_):
+      yield from leafViews(ctype._type_, view[..., i])
+
+def viewCTypes(ctype, values):
+  """Like vectorizeCTypes, but the leaves are zero-copy views into values.
+
+  values must be a ctypes array of ctype. The views alias its memory, so
+  copy them if values is going to be overwritten.
+  """
+  return splitView(ctype, np.frombuffer(values, dtype=toDType(ctype)))
+
+def leafFields(ctype, path=(), offset=0):
+  """Yields (path, ctype, byte offset) for every primitive field of ctype."""
+  if ctype in numpyCTypes:
+    yield path, ctype, offset
+  elif issubclass(ctype, Structure):
+    for f, t in ctype._fields_:
+      yield from leafFields(t, path + (f,), offset + getattr(ctype, f).offset)
+  else: # assume an array type
+    base_type = ctype._type_
+    for i in range(ctype._length_):
+      yield from leafFields(base_type, path + (i,), offset + i * sizeof(base_type))
+
+def unflattenCType(ctype, columns):
+  """Rebuilds the inputCType structure from an iterator of float columns."""
+  if ctype in ctypes2TF:
+    import tensorflow as tf
+    return tf.cast(next(columns), tf.as_dtype(ctypes2TF[ctype]))
+  elif issubclass(ctype, Structure):
+    return {f : unflattenCType(t, columns) for (f, t) in ctype._fields_}
+  else: # assume an array type
+    base_type = ctype._type_
+    return [unflattenCType(base_type, columns) for i in range(ctype._length_)]
+
+class FlatLayout:
+  """Flattens arrays of a ctype into float32 rows with a column per leaf field.
+
+  The byte offsets of every field are worked out once, so flattening is a
+  few numpy gathers instead of a python walk over the structure.
+  """
+  def __init__(self, ctype):
+    self.ctype = ctype
+    self.leaves = list(leafFields(ctype))
+    self.size = len(self.leaves)
+    
+    self.groups = []
+    for leaf_type in set(t for _, t, _ in self.leaves):
+      columns = [i for i, (_, t, _) in enumerate(self.leaves) if t is leaf_type]
+      offsets = np.array([self.leaves[i][2] for i in columns])
+      width = sizeof(leaf_type)
+      byte_indices = (offsets[:, None] + np.arange(width)).reshape(-1)
+      self.groups.append((np.array(columns), byte_indices, np.dtype(numpyCTypes[leaf_type])))
+  
+  def flatten(self, values, start=0, out=None):
+    """Flattens a ctypes array into a [len(values), size] float32 array.
+
+    Rows are taken in circular order beginning at start.
+    """
+    n = len(values)
+    raw = np.frombuffer(values, dtype=np.uint8).reshape(n, sizeof(self.ctype))
+    if start:
+      raw = raw[(start + np.arange(n)) % n]
+    
+    if out is None:
+      out = np.empty((n, self.size), dtype=np.float32)
+    
+    for columns, byte_indices, dtype in self.groups:
+      out[:, columns] = raw.take(byte_indices, axis=1).view(dtype)
+    
+    return out
+  
+  def unflatten(self, t, axis=-1):
+    """Splits a float tensor back into the structure given by inputCType."""
+    import tensorflow as tf
+    rank = len(t.get_shape())
+    columns = iter(tf.unpack(t, axis=axis % rank))
+    return unflattenCType(self.ctype, columns)
+
+def benchmarkFlatten(frames=4, trials=2000):
+  """Times preparing an agent's history for the policy, per act.
+
+  The old path vectorized the history into a dict and fed every leaf
+  separately, which FlatLayout replaces with a single array. Both leave
+  out sess.run itself.
+  """
+  import timeit
+  import ssbm
+  import util
+  
+  values = (frames * ssbm.SimpleStateAction)()
+  queue = util.CircularQueue(array=values)
+  layout = FlatLayout(ssbm.SimpleStateAction)
+  out = np.empty((frames, layout.size), dtype=np.float32)
+  # stand-ins for the placeholders
+  inputs = util.deepMap(lambda _: object(), vectorizeCTypes(ssbm.SimpleStateAction, queue.as_list()))
+  
+  def vectorized():
+    history = vectorizeCTypes(ssbm.SimpleStateAction, queue.as_list())
+    return dict(util.deepValues(util.deepZip(inputs, history)))
+  
+  def flat():
+    return {'input/flat': layout.flatten(queue.array, queue.index, out)}
+  
+  for name, run in [('vectorized feed', vectorized), ('flat feed', flat)]:
+    t = min(timeit.repeat(run, number=trials, repeat=5)) / trials
+    print("%s: %.1fus per act" % (name, 1e6 * t))
+
+if __name__ == '__main__':
+  benchmarkFlatten()
@@ -59,6 +59,14 @@ class Default:
     kwargs.update(**override)
     return cls(**kwargs)
   
+def parseBool(s):
+  """argparse's type=bool makes any non-empty string, even "False", True."""
+  if s.lower() in ['true', 't', 'yes', 'y', '1']:
+    return True
+  if s.lower() in ['false', 'f', 'no', 'n', '0']:
+    return False
+  raise ValueError("Not a boolean: %s" % s)
+
 class Option:
   def __init__(self, name, **kwargs):
     self.name = name
@@ -68,6 +76,10 @@ class Option:
     
     # don't pass default on to argparse
     self.kwargs['default'] = None
+    
+    # both --flag and --flag False work
+    if kwargs.get('type') is bool:
+      self.kwargs.update(type=parseBool, nargs='?', const=True)
   
   def update_parser(self, parser):
     flag = "--" + self.name
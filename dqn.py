@@ -3,15 +3,11 @@ import tf_lib as tfl
 import util
 from numpy import random
 from default import *
+import model_options
 import opt
 
 class DQN(Default):
-  _options = [
-    Option('q_layers', type=int, nargs='+', default=[128, 128], help="sizes of the dqn hidden layers"),
-    Option('epsilon', type=float, default=0.02, help="pick random action with probability EPSILON"),
-    Option('temperature', type=float, default=0.01, help="Boltzmann distribution over actions"),
-    Option('sarsa', type=bool, default=True, help="use action taken instead of max when computing target Q-values"),
-  ]
+  _options = model_options.DQN._options
   
   _members = [
     ('optimizer', opt.Optimizer)
@@ -40,7 +36,7 @@ class DQN(Default):
   def getVariables(self):
     return self.q_net.getVariables()
   
-  def train(self, states, actions, rewards):
+  def train(self, states, actions, rewards, weights=None, **unused):
     n = self.rlConfig.tdN
     
     state_shape = tf.shape(states)
@@ -68,7 +64,13 @@ class DQN(Default):
       targets = tf.slice(rewards, [0, i], [-1, train_length]) + self.rlConfig.discount * targets
     targets = tf.stop_gradient(targets)
 
+    # for prioritized replay
+    self.priorities = tf.reduce_mean(tf.abs(trainQs - targets), 1)
+    
     qLosses = tf.squared_difference(trainQs, targets)
+    if weights is not None:
+      # importance sampling weights, one per experience
+      qLosses *= tf.expand_dims(weights, 1)
     qLoss = tf.reduce_mean(qLosses)
     tf.scalar_summary("q_loss", qLoss)
     
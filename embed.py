@@ -3,6 +3,7 @@ import tf_lib as tfl
 import util
 import ssbm
 from default import *
+import model_options
 
 floatType = tf.float32
 
@@ -120,19 +121,11 @@ controllerEmbedding = [
 
 embedController = StructEmbedding(controllerEmbedding)
 
-maxAction = 0x017E
-numActions = 1 + maxAction
-
-maxCharacter = 32 # should be large enough?
+from model_options import maxAction, numActions, maxCharacter
 maxJumps = 8
 
 class PlayerEmbedding(StructEmbedding, Default):
-  _options = [
-    Option('action_space', type=int, default=64, help="embed actions in ACTION_SPACE dimensions"),
-    Option('xy_scale', type=float, default=0.1, help="scale xy coordinates"),
-    Option('shield_scale', type=float, default=0.01),
-    Option('speed_scale', type=float, default=0.5),
-  ]
+  _options = model_options.PlayerEmbedding._options
   
   def __init__(self, **kwargs):
     Default.__init__(self, **kwargs)
@@ -183,10 +176,7 @@ def embedStage(stage):
 """
 
 class GameEmbedding(StructEmbedding, Default):
-  _options = [
-    #Option('swap', type=bool, default=False, help="swap players 1 and 2"),
-    Option('player_space', type=int, default=64, help="embed players into PLAYER_SPACE dimensions"),
-  ]
+  _options = model_options.GameEmbedding._options
   
   _members = [
     ('embedPlayer', PlayerEmbedding)
@@ -228,6 +218,6 @@ simpleControllerEmbedding = [
 # NOTE: this is unused for now - we embed the previous action using a simple one-hot
 embedSimpleController = StructEmbedding(simpleControllerEmbedding)
 
-action_size = len(ssbm.simpleControllerStates)
+from model_options import action_size
 embedAction = OneHotEmbedding(action_size)
 
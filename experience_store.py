@@ -0,0 +1,143 @@
+"""
+An append-only, memory-mapped store of experiences on disk.
+
+A store is a directory with three files:
+  records - the SimpleStateActions of every experience, back to back
+  initial - the pickled initial hidden state of every experience
+  index   - a header, then one fixed-size entry per experience
+
+Entries are only added to the index after the data they point to has been
+written, so readers never see a partial experience. There should be at most
+one writer, but any number of readers (other trainers, offline tools), which
+pick up new experiences with refresh().
+"""
+
+import os
+import pickle
+import struct
+import numpy as np
+from numpy import random
+from ctypes import sizeof
+import ssbm
+import ctype_util as ct
+
+indexHeader = struct.Struct('<4sI') # magic, record size
+indexMagic = b'SSX1'
+
+indexDType = np.dtype([
+  ('start', '<u8'), # first record
+  ('length', '<u4'), # number of records
+  ('initial', '<u8'), # byte offset into the initial file
+  ('initial_size', '<u4'),
+])
+
+recordDType = ct.toDType(ssbm.SimpleStateAction)
+
+class ExperienceStore:
+  def __init__(self, path, write=False):
+    self.path = path
+    self.write = write
+
+    index_path = os.path.join(path, 'index')
+
+    if write:
+      os.makedirs(path, exist_ok=True)
+      if not os.path.exists(index_path):
+        with open(index_path, 'wb') as f:
+          f.write(indexHeader.pack(indexMagic, sizeof(ssbm.SimpleStateAction)))
+
+    with open(index_path, 'rb') as f:
+      magic, itemsize = indexHeader.unpack(f.read(indexHeader.size))
+    if magic != indexMagic or itemsize != sizeof(ssbm.SimpleStateAction):
+      raise ValueError("%s is not a compatible experience store" % path)
+
+    if write:
+      self.files = {name: open(os.path.join(path, name), 'ab') for name in ['records', 'initial', 'index']}
+
+    self.refresh()
+
+  def _map(self, name, dtype, offset=0):
+    filename = os.path.join(self.path, name)
+    count = (os.path.getsize(filename) - offset) // dtype.itemsize
+    if count == 0:
+      return np.empty(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+  def refresh(self):
+    """Maps in any experiences appended since the last refresh."""
+    self.index = self._map('index', indexDType, indexHeader.size)
+    self.records = self._map('records', recordDType)
+
+  def __len__(self):
+    return len(self.index)
+
+  def append(self, state_actions, initial):
+    """Adds an experience, given as a ctypes or numpy array of SimpleStateActions."""
+    if not self.write:
+      raise TypeError("Store %s was not opened for writing" % self.path)
+
+    records = self.files['records']
+    start = records.tell() // recordDType.itemsize
+    records.write(memoryview(state_actions).cast('B'))
+    records.flush()
+
+    pickled = pickle.dumps(initial)
+    offset = self.files['initial'].tell()
+    self.files['initial'].write(pickled)
+    self.files['initial'].flush()
+
+    entry = np.array([(start, len(state_actions), offset, len(pickled))], dtype=indexDType)
+    self.files['index'].write(entry.tobytes())
+    self.files['index'].flush()
+
+  def close(self):
+    if self.write:
+      for f in self.files.values():
+        f.close()
+
+  def _initial(self, entry):
+    with open(os.path.join(self.path, 'initial'), 'rb') as f:
+      f.seek(int(entry['initial']))
+      return pickle.loads(f.read(int(entry['initial_size'])))
+
+  def _records(self, start, length):
+    if start + length > len(self.records):
+      self.records = self._map('records', recordDType)
+    return self.records[start:start+length]
+
+  def get(self, i):
+    """Returns the SimpleStateActions of experience i (a view into the map), and its initial state."""
+    entry = self.index[i]
+    return self._records(int(entry['start']), int(entry['length'])), self._initial(entry)
+
+  def experience(self, i):
+    """Experience i in the form the trainer uses."""
+    return ssbm.prepareExperience(*self.get(i))
+
+  def window(self, i, start, length):
+    """Frames [start, start+length) of experience i."""
+    entry = self.index[i]
+    if start < 0 or start + length > entry['length']:
+      raise IndexError("Window %d:%d out of range for experience %d" % (start, start+length, i))
+    return self._records(int(entry['start']) + start, length)
+
+  def sample(self, length, count=1):
+    """Random windows of frames, each from within a single experience.
+
+    Returns a numpy array of SimpleStateActions shaped [count, length].
+    """
+    lengths = self.index['length'].astype(np.int64)
+    valid = np.flatnonzero(lengths >= length)
+    if len(valid) == 0:
+      raise ValueError("No experiences with at least %d frames" % length)
+
+    experiences = valid[random.randint(len(valid), size=count)]
+    offsets = random.randint(lengths[experiences] - length + 1)
+    starts = self.index['start'][experiences].astype(np.int64) + offsets
+
+    self._records(int(starts.max()), length)
+    return self.records[starts[:, None] + np.arange(length)]
+
+  def latest(self, n):
+    """The last n experiences, oldest first."""
+    return [self.experience(i) for i in range(max(len(self) - n, 0), len(self))]
@@ -1,3 +1,5 @@
+from ctypes import sizeof
+
 def getField(obj, field):
     if isinstance(field, str):
         return getattr(obj, field)
@@ -23,3 +25,19 @@ def setPath(obj, path, val):
     obj = getPath(obj, path[:-1])
     setField(obj, path[-1], val)
 
+
+def offsetPath(ctype, path):
+    """Resolves a path to a (byte offset, field ctype) pair within ctype."""
+    offset = 0
+    for field in path:
+        if isinstance(field, str):
+            if not hasattr(ctype, field):
+                raise TypeError("%s has no field %s" % (ctype, field))
+            offset += getattr(ctype, field).offset
+            ctype = dict(ctype._fields_)[field]
+        else: # assume an array
+            if not 0 <= field < ctype._length_:
+                raise IndexError("%s index %d out of range" % (ctype, field))
+            ctype = ctype._type_
+            offset += field * sizeof(ctype)
+    return offset, ctype
@@ -124,6 +124,9 @@ if run_agents:
   agent_count = 0
   agent_command = "python3 -u run.py --load " + args.path
   agent_command += " --dump " + agent_dump
+  if params['train'].get('publish'):
+    # take weights from the trainer as it publishes them
+    agent_command += " --subscribe " + agent_dump
   if not args.local:
     agent_command += " --cpu_thread"
 
@@ -3,6 +3,16 @@ import util
 import os
 import sys
 import socket
+import select
+import struct
+from collections import deque
+import numpy as np
+
+def parseDatagram(data):
+  data = data.decode('utf-8').splitlines()
+  assert len(data) == 2
+  # Strip the null terminator, pad with zeros, then convert to bytes
+  return data[0], binascii.unhexlify(data[1].strip('\x00').zfill(8))
 
 def parseMessage(message):
   lines = message.splitlines()
@@ -14,8 +24,43 @@ def parseMessage(message):
   
   return diffs
 
+# compact form of a message: the address id (see StateManager) and raw value
+diffType = np.dtype([('address', np.uint32), ('value', np.uint32)])
+
+def decodeMessage(message, ids):
+  """Decodes a raw message straight into an array of diffType.
+
+  ids maps the address bytes from Locations.txt to integer ids.
+  """
+  lines = message.splitlines()
+  n = len(lines) // 2
+
+  diffs = np.empty(n, dtype=diffType)
+  diffs['address'] = [ids[address] for address in lines[0:2*n:2]]
+  diffs['value'] = [int(value, 16) for value in lines[1:2*n:2]]
+
+  return diffs
+
+# Binary framing: a header, then fixed-width records of address id and value.
+# Values stay big-endian, exactly as dolphin reads them out of memory.
+binaryHeader = struct.Struct('<II') # frame number, number of records
+binaryDiffType = np.dtype([('address', '<u2'), ('value', '>u4')])
+
+def encodeBinary(frame, diffs):
+  """Packs an array of diffType into a binary message."""
+  records = np.empty(len(diffs), dtype=binaryDiffType)
+  records['address'] = diffs['address']
+  records['value'] = diffs['value']
+  return binaryHeader.pack(frame, len(records)) + records.tobytes()
+
+def decodeBinary(message):
+  """Returns the frame number and a zero-copy binaryDiffType view of message."""
+  frame, n = binaryHeader.unpack_from(message)
+  return frame, np.frombuffer(message, dtype=binaryDiffType, count=n, offset=binaryHeader.size)
+
 class MemoryWatcherZMQ:
-  def __init__(self, path):
+  def __init__(self, path, ids=None):
+    """Binds the socket. Pass the StateManager ids to enable get_diffs."""
     try:
       import zmq
     except ImportError as err:
@@ -28,6 +73,15 @@ class MemoryWatcherZMQ:
     self.socket.bind("ipc://" + path)
     
     self.messages = None
+    
+    if ids is not None:
+      self.ids = {address.encode(): i for address, i in ids.items()}
+  
+  def get_diffs(self):
+    if self.messages is None:
+      self.messages = decodeMessage(self.socket.recv(), self.ids)
+    
+    return self.messages
   
   def get_messages(self):
     if self.messages is None:
@@ -41,14 +95,47 @@ class MemoryWatcherZMQ:
     self.socket.send(b'')
     self.messages = None
 
+class MemoryWatcherBinary(MemoryWatcherZMQ):
+  """Like MemoryWatcherZMQ, but the other end sends encodeBinary messages."""
+  def __init__(self, path):
+    MemoryWatcherZMQ.__init__(self, path)
+    self.frame = None
+  
+  def get_diffs(self):
+    if self.messages is None:
+      message = self.socket.recv(copy=False)
+      self.frame, self.messages = decodeBinary(message.buffer)
+    
+    return self.messages
+  
+  def get_messages(self):
+    raise TypeError("binary messages carry address ids, use get_diffs")
+
+class BinaryEmitter:
+  """Stands in for dolphin on the other end of a MemoryWatcherBinary."""
+  def __init__(self, path):
+    import zmq
+    context = zmq.Context()
+    
+    self.socket = context.socket(zmq.REQ)
+    self.socket.connect("ipc://" + path)
+  
+  def send(self, frame, diffs):
+    """Sends one frame of diffType records and waits for the reply."""
+    self.socket.send(encodeBinary(frame, diffs))
+    self.socket.recv()
+
 class MemoryWatcher:
   """Reads and parses game memory changes.
 
   Pass the location of the socket to the constructor, then either manually
   call next() on this class to get a single change, or else use it like a
   normal iterator.
+
+  If frames is set, get_messages drains the socket and returns the changes
+  for one whole frame at a time.
   """
-  def __init__(self, path):
+  def __init__(self, path, frames=False):
     """Creates the socket if it does not exist, and then opens it."""
     try:
       os.unlink(path)
@@ -57,6 +144,14 @@ class MemoryWatcher:
     self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
     self.sock.settimeout(1)
     self.sock.bind(path)
+    
+    self.frames = frames
+    if frames:
+      # drain() does its own waiting and reads until the socket is empty
+      self.timeout = self.sock.gettimeout()
+      self.sock.setblocking(False)
+    self.queue = deque()
+    self.pending = []
 
   def __iter__(self):
     """Iterate over this class in the usual way to get memory changes."""
@@ -73,14 +168,55 @@ class MemoryWatcher:
     value is a four-byte string suitable for interpretation with struct.
     """
     try:
-      data = self.sock.recvfrom(1024)[0].decode('utf-8').splitlines()
+      data = self.sock.recvfrom(1024)[0]
     except socket.timeout:
       return None
-    assert len(data) == 2
-    # Strip the null terminator, pad with zeros, then convert to bytes
-    return data[0], binascii.unhexlify(data[1].strip('\x00').zfill(8))
+    return parseDatagram(data)
+  
+  def drain(self):
+    """Queues up every pending datagram, blocking only for the first.
+
+    Returns False on timeout.
+    """
+    if not select.select([self.sock], [], [], self.timeout)[0]:
+      return False
+    
+    received = []
+    try:
+      while True:
+        received.append(self.sock.recv(1024))
+    except BlockingIOError:
+      pass
+    
+    self.queue.extend(map(parseDatagram, received))
+    return True
+  
+  def get_frame(self):
+    """Returns all the changes for the next complete frame.
+
+    Dolphin walks its watched addresses in a std::map, so each frame's
+    changes come in sorted address order, and the frame counter (which is in
+    every frame) keeps consecutive frames from forming one sorted run. So a
+    frame ends where an address isn't greater than the one before it. That
+    can only be seen once the next frame has started, which adds a frame of
+    latency. On timeout whatever was collected so far is returned.
+    """
+    while True:
+      while self.queue:
+        message = self.queue.popleft()
+        if self.pending and message[0] <= self.pending[-1][0]:
+          frame, self.pending = self.pending, [message]
+          return frame
+        self.pending.append(message)
+      
+      if not self.drain():
+        frame, self.pending = self.pending, []
+        return frame
   
   def get_messages(self):
+    if self.frames:
+      return self.get_frame()
+    
     res = next(self)
     if res is not None:
       return [res]
@@ -89,3 +225,46 @@ class MemoryWatcher:
   def advance(self):
     pass
 
+def benchmark(frames=2000, changes=40):
+  """Compares decode + apply throughput of the text and binary formats."""
+  import random
+  import timeit
+  import ssbm
+  import state_manager
+  
+  sm = state_manager.CompiledStateManager([0, 1])
+  ids = {address.encode(): i for address, i in sm.ids.items()}
+  addresses = list(sm.ids)
+  state = ssbm.GameMemory()
+  
+  text = []
+  binary = []
+  for frame in range(frames):
+    diffs = np.empty(changes, dtype=diffType)
+    diffs['address'] = random.sample(range(len(addresses)), changes)
+    diffs['value'] = [random.getrandbits(16) for _ in range(changes)]
+    lines = ["%s\n%x" % (addresses[a], v) for a, v in diffs]
+    text.append('\n'.join(lines).encode())
+    binary.append(encodeBinary(frame, diffs))
+  
+  def run_text():
+    for message in text:
+      for diff in parseMessage(message.decode('utf-8')):
+        sm.handle(state, *diff)
+  
+  def run_decoded():
+    for message in text:
+      sm.handle_diffs(state, decodeMessage(message, ids))
+  
+  def run_binary():
+    for message in binary:
+      sm.handle_diffs(state, decodeBinary(message)[1])
+  
+  for name, run in [('text', run_text), ('text (decodeMessage)', run_decoded), ('binary', run_binary)]:
+    t = min(timeit.repeat(run, number=1, repeat=5))
+    print("%s: %.0f messages/sec" % (name, frames * changes / t))
+  
+  print("bytes/frame: text %d, binary %d" % (len(text[0]), len(binary[0])))
+
+if __name__ == '__main__':
+  benchmark()
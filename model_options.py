@@ -0,0 +1,138 @@
+"""
+The options and constants of the model, without tensorflow.
+
+These classes mirror the option tree of RL.Model and the model types
+(including their optimizers), and the tensorflow classes take their _options
+from here. numpy_policy and the agent's option parsing use them directly, so
+acting with --numpy never imports tensorflow.
+"""
+
+import ssbm
+from default import *
+
+maxAction = 0x017E
+numActions = 1 + maxAction
+
+maxCharacter = 32 # should be large enough?
+
+action_size = len(ssbm.simpleControllerStates)
+
+class RLConfig(Default):
+  _options = [
+    Option('tdN', type=int, default=5, help="use n-step TD error"),
+    Option('reward_halflife', type=float, default=2.0, help="time to discount rewards by half, in seconds"),
+    Option('act_every', type=int, default=3, help="Take an action every ACT_EVERY frames."),
+    Option('experience_time', type=int, default=60, help="Length of experiences, in seconds."),
+  ]
+
+  def __init__(self, **kwargs):
+    super(RLConfig, self).__init__(**kwargs)
+    self.fps = 60 // self.act_every
+    self.discount = 0.5 ** ( 1.0 / (self.fps*self.reward_halflife) )
+    self.experience_length = self.experience_time * self.fps
+
+class PlayerEmbedding(Default):
+  _options = [
+    Option('action_space', type=int, default=64, help="embed actions in ACTION_SPACE dimensions"),
+    Option('xy_scale', type=float, default=0.1, help="scale xy coordinates"),
+    Option('shield_scale', type=float, default=0.01),
+    Option('speed_scale', type=float, default=0.5),
+  ]
+
+class GameEmbedding(Default):
+  _options = [
+    #Option('swap', type=bool, default=False, help="swap players 1 and 2"),
+    Option('player_space', type=int, default=64, help="embed players into PLAYER_SPACE dimensions"),
+  ]
+
+  _members = [
+    ('embedPlayer', PlayerEmbedding)
+  ]
+
+class ConjugateGradient(Default):
+  _options = [
+    Option('cg_iters', type=int, default=10, help="Maximum number of conjugate gradient iterations."),
+    Option('residual_tol', type=float, default=1e-10, help="Minimum conjugate gradient residual tolerance."),
+    Option('cg_damping', type=float, default=1e-4, help="Add a multiple of the identity function during conjugate gradient descent."),
+  ]
+
+class NaturalGradient(Default):
+  _options = [
+    Option('target_distance', type=float, default=None, help="Target natural gradient distance."),
+  ]
+
+  _members = [
+    ('cg', ConjugateGradient),
+  ]
+
+class Optimizer(Default):
+  _options = [
+    Option('learning_rate', type=float, default=0.001),
+    Option('optimizer', type=str, default="GradientDescent", help="which tf.train optimizer to use"),
+    Option('natural', action="store_true", help="Use natural gradient."),
+    Option('clip', type=float, help="clip gradients above a certain value")
+  ]
+
+  _members = [
+    ('natgrad', NaturalGradient)
+  ]
+
+class DQN(Default):
+  _options = [
+    Option('q_layers', type=int, nargs='+', default=[128, 128], help="sizes of the dqn hidden layers"),
+    Option('epsilon', type=float, default=0.02, help="pick random action with probability EPSILON"),
+    Option('temperature', type=float, default=0.01, help="Boltzmann distribution over actions"),
+    Option('sarsa', type=bool, default=True, help="use action taken instead of max when computing target Q-values"),
+  ]
+
+  _members = [
+    ('optimizer', Optimizer)
+  ]
+
+class ActorCritic(Default):
+  _options = [
+    Option('actor_layers', type=int, nargs='+', default=[128, 128]),
+    Option('critic_layers', type=int, nargs='+', default=[128, 128]),
+
+    Option('epsilon', type=float, default=0.02),
+
+    Option('entropy_scale', type=float, default=0.001),
+    Option('policy_scale', type=float, default=0.1),
+
+    Option('kl_scale', type=float, default=1.0, help="kl divergence weight in natural metric"),
+  ]
+
+  _members = [
+    ('optimizer', Optimizer)
+  ]
+
+class RecurrentActorCritic(Default):
+  _options = ActorCritic._options
+
+  _members = [
+    ('optimizer', Optimizer)
+  ]
+
+models = [
+  DQN,
+  ActorCritic,
+  RecurrentActorCritic,
+]
+models = {model.__name__ : model for model in models}
+
+class Model(Default):
+  _options = [
+    Option('model', type=str, default="DQN", choices=models.keys()),
+    Option('path', type=str, help="path to saved model"),
+    Option('gpu', type=bool, default=False, help="train on gpu"),
+    Option('memory', type=int, default=0, help="number of frames to remember"),
+    Option('summary_every', type=int, default=1, help="write summaries every N global steps"),
+    Option('graph_cache', type=str, help="directory in which to cache play-mode graphs, keyed by the params"),
+    Option('resident_batch', type=bool, default=False, help="load each batch onto the device once, instead of feeding it on every step"),
+    Option('name', type=str)
+  ]
+
+  _members = [
+    ('rlConfig', RLConfig),
+    ('embedGame', GameEmbedding),
+  ]
@@ -1,12 +1,11 @@
 import tensorflow as tf
 from default import *
+import model_options
 import tf_lib as tfl
 import cg
 
 class NaturalGradient(Default):
-  _options = [
-    Option('target_distance', type=float, default=None, help="Target natural gradient distance."),
-  ]
+  _options = model_options.NaturalGradient._options
   
   _members = [
     ('cg', cg.ConjugateGradient),
@@ -0,0 +1,392 @@
+"""
+A pure numpy version of the play-mode RL.Model, for acting without a tf session.
+
+Only the feed-forward models (ActorCritic and DQN) are supported. Weights are
+read from the checkpoint, and matched up with the layers here by the order in
+which tensorflow created them (saved alongside the checkpoint by Model.save).
+
+Nothing here imports tensorflow. The options and constants are shared with the
+tensorflow modules through model_options.
+"""
+
+import json
+import numpy as np
+from numpy import random
+import ssbm
+import ctype_util as ct
+import snapshot
+from default import *
+import model_options
+from model_options import numActions, maxCharacter, action_size
+
+def leaky_softplus(alpha=0.01):
+  return lambda x: np.logaddexp(alpha * x, x)
+
+def softmax(x):
+  e = np.exp(x - np.max(x, -1, keepdims=True))
+  return e / np.sum(e, -1, keepdims=True)
+
+class Weights:
+  """Hands out arrays in the order that tensorflow created the variables."""
+  def __init__(self, names, values):
+    self.names = names
+    self.values = values
+    self.index = 0
+
+  def take(self, shape):
+    name = self.names[self.index]
+    value = self.values[self.index]
+    if list(value.shape) != list(shape):
+      raise ValueError("Expected shape %s for %s, got %s" % (shape, name, value.shape))
+    self.index += 1
+    return value
+
+  def check_done(self):
+    if self.index != len(self.names):
+      raise ValueError("Unused variables: %s" % self.names[self.index:])
+
+def loadWeights(path):
+  with open(path + 'snapshot.vars') as f:
+    names = json.load(f)
+
+  if snapshot.latestSnapshot(path) == 'raw':
+    blob = snapshot.loadRaw(path + 'snapshot.raw')
+    return Weights(names, [blob[name] for name in names])
+
+  # only used to read the checkpoint - no graph or session is built
+  import tensorflow as tf
+  reader = tf.train.NewCheckpointReader(path + 'snapshot')
+  values = [reader.get_tensor(name.split(':')[0]) for name in names]
+
+  return Weights(names, values)
+
+class FCLayer:
+  def __init__(self, weights, input_size, output_size, nl=None):
+    self.weight = weights.take([input_size, output_size])
+    self.bias = weights.take([output_size])
+    self.nl = nl
+
+  def __call__(self, x):
+    y = np.dot(x, self.weight) + self.bias
+    return self.nl(y) if self.nl else y
+
+class Sequential:
+  def __init__(self, *layers):
+    self.layers = list(layers)
+
+  def append(self, layer):
+    self.layers.append(layer)
+
+  def __call__(self, x):
+    for f in self.layers:
+      x = f(x)
+    return x
+
+# The embeddings mirror those in embed.py. Instead of tensors they take the
+# flat history from FlatLayout along with the column indices of each field.
+
+def indexCType(ctype, columns):
+  """Like ct.unflattenCType, but with the column indices themselves."""
+  if ctype in ct.ctypes2TF:
+    return next(columns)
+  elif issubclass(ctype, ct.Structure):
+    return {f : indexCType(t, columns) for (f, t) in ctype._fields_}
+  else: # assume an array type
+    return [indexCType(ctype._type_, columns) for i in range(ctype._length_)]
+
+class FloatEmbedding(object):
+  def __init__(self, scale=None, bias=None, lower=-10.0, upper=10.0):
+    self.scale = scale
+    self.bias = bias
+    self.lower = lower
+    self.upper = upper
+    self.size = 1
+
+  def __call__(self, flat, column):
+    t = flat[:, column]
+
+    if self.bias:
+      t = t + self.bias
+
+    if self.scale:
+      t = t * self.scale
+
+    if self.lower:
+      t = np.maximum(t, self.lower)
+
+    if self.upper:
+      t = np.minimum(t, self.upper)
+
+    return t[:, None]
+
+embedFloat = FloatEmbedding()
+
+class OneHotEmbedding(object):
+  def __init__(self, size):
+    self.size = size
+
+  def __call__(self, flat, column):
+    t = flat[:, column].astype(np.int64)
+    # out of range values give all zeros, as with tf.one_hot
+    return (t[:, None] == np.arange(self.size)).astype(np.float32)
+
+class StructEmbedding(object):
+  def __init__(self, embedding):
+    self.embedding = embedding
+    self.size = sum(op.size for _, op in embedding)
+
+  def __call__(self, flat, struct):
+    return np.concatenate([op(flat, struct[field]) for field, op in self.embedding], -1)
+
+class ArrayEmbedding(object):
+  def __init__(self, op, permutation):
+    self.op = op
+    self.permutation = permutation
+    self.size = len(permutation) * op.size
+
+  def __call__(self, flat, array):
+    return np.concatenate([self.op(flat, array[i]) for i in self.permutation], -1)
+
+class FCEmbedding(object):
+  def __init__(self, weights, wrapper, size):
+    self.wrapper = wrapper
+    self.fc = FCLayer(weights, wrapper.size, size, leaky_softplus())
+    self.size = size
+
+  def __call__(self, flat, struct):
+    return self.fc(self.wrapper(flat, struct))
+
+class PlayerEmbedding(StructEmbedding, Default):
+  _options = model_options.PlayerEmbedding._options
+
+  def __init__(self, weights, **kwargs):
+    Default.__init__(self, **kwargs)
+
+    embedAction = OneHotEmbedding(numActions)
+    if self.action_space:
+      embedAction = FCEmbedding(weights, embedAction, self.action_space)
+
+    embedXY = FloatEmbedding(scale=self.xy_scale)
+    embedSpeed = FloatEmbedding(scale=self.speed_scale)
+
+    playerEmbedding = [
+      ("percent", FloatEmbedding(scale=0.01)),
+      ("facing", embedFloat),
+      ("x", embedXY),
+      ("y", embedXY),
+      ("action_state", embedAction),
+      ("action_frame", FloatEmbedding(scale=0.02)),
+      ("character", OneHotEmbedding(maxCharacter)),
+      ("invulnerable", embedFloat),
+      ("hitlag_frames_left", embedFloat),
+      ("hitstun_frames_left", embedFloat),
+      ("jumps_used", embedFloat),
+      ("charging_smash", embedFloat),
+      ("shield_size", FloatEmbedding(scale=self.shield_scale)),
+      ("in_air", embedFloat),
+      ('speed_air_x_self', embedSpeed),
+      ('speed_ground_x_self', embedSpeed),
+      ('speed_y_self', embedSpeed),
+      ('speed_x_attack', embedSpeed),
+      ('speed_y_attack', embedSpeed),
+    ]
+
+    StructEmbedding.__init__(self, playerEmbedding)
+
+class GameEmbedding(StructEmbedding, Default):
+  _options = model_options.GameEmbedding._options
+
+  def __init__(self, weights, swap=False, **kwargs):
+    Default.__init__(self, **kwargs)
+
+    self.embedPlayer = PlayerEmbedding(weights, **kwargs)
+    if self.player_space:
+      self.embedPlayer = FCEmbedding(weights, self.embedPlayer, self.player_space)
+
+    players = [0, 1]
+    if swap: players.reverse()
+
+    StructEmbedding.__init__(self, [('players', ArrayEmbedding(self.embedPlayer, players))])
+
+class ActorCritic(Default):
+  _options = model_options.ActorCritic._options
+
+  hidden_size = []
+
+  def __init__(self, weights, state_size, action_size, **kwargs):
+    Default.__init__(self, **kwargs)
+
+    self.action_size = action_size
+
+    # layers are created in the same order as ac.ActorCritic
+    for name in ['actor', 'critic']:
+      net = Sequential()
+      prev_size = state_size
+      for next_size in getattr(self, name + "_layers"):
+        net.append(FCLayer(weights, prev_size, next_size, leaky_softplus()))
+        prev_size = next_size
+      setattr(self, name, net)
+
+    self.actor.append(FCLayer(weights, prev_size, action_size, softmax))
+    self.actor.append(lambda p: (1. - self.epsilon) * p + self.epsilon / action_size)
+
+    # the critic isn't needed to act
+    FCLayer(weights, prev_size, 1)
+
+  def getPolicy(self, state):
+    return self.actor(state)
+
+  def act(self, policy, verbose=False):
+    return random.choice(range(self.action_size), p=policy), []
+
+class DQN(Default):
+  _options = model_options.DQN._options
+
+  hidden_size = []
+
+  def __init__(self, weights, state_size, action_size, **kwargs):
+    Default.__init__(self, **kwargs)
+
+    self.action_size = action_size
+
+    self.q_net = Sequential()
+    prev_size = state_size
+    for size in self.q_layers:
+      self.q_net.append(FCLayer(weights, prev_size, size, leaky_softplus()))
+      prev_size = size
+    self.q_net.append(FCLayer(weights, prev_size, action_size))
+
+  def getPolicy(self, state):
+    qValues = self.q_net(state)
+
+    if self.epsilon and random.uniform() < self.epsilon:
+      action = random.randint(self.action_size)
+    elif self.temperature:
+      action = random.choice(range(self.action_size), p=softmax(qValues / self.temperature))
+    else:
+      action = np.argmax(qValues)
+
+    return action, qValues
+
+  def act(self, policy, verbose=False):
+    action, qValues = policy
+    if verbose:
+      print(qValues)
+    return action, []
+
+models = {model.__name__ : model for model in [ActorCritic, DQN]}
+
+class Policy(Default):
+  """Stands in for an RL.Model in play mode (see Agent's numpy option).
+
+  Call restore to load the weights before acting.
+  """
+  _options = model_options.Model._options
+
+  _members = [
+    ('rlConfig', model_options.RLConfig),
+  ]
+
+  def __init__(self, swap=False, **kwargs):
+    Default.__init__(self, **kwargs)
+
+    if self.name is None:
+      self.name = self.model
+
+    if self.path is None:
+      self.path = "saves/%s/" % self.name
+
+    if self.model not in models:
+      raise ValueError("No numpy version of %s" % self.model)
+    self.modelType = models[self.model]
+
+    self.swap = swap
+
+    self.layout = ct.FlatLayout(ssbm.SimpleStateAction)
+    self.columns = indexCType(ssbm.SimpleStateAction, iter(range(self.layout.size)))
+    self.embedPrevAction = OneHotEmbedding(action_size)
+
+  def restore(self):
+    print("Restoring from", self.path)
+    weights = loadWeights(self.path)
+    self.names = weights.names
+    self.build(weights)
+
+  def unblob(self, blob):
+    """Takes new weights from an RL.Model.blob, as sent by the trainer."""
+    self.build(Weights(self.names, [blob[name] for name in self.names]))
+
+  def build(self, weights):
+    embedGame = GameEmbedding(weights, swap=self.swap, **self._kwargs)
+    history_size = (1+self.memory) * (embedGame.size+action_size)
+    model = self.modelType(weights, history_size, action_size, **self._kwargs)
+
+    weights.check_done()
+
+    # swapped in together, since unblob is called from another thread
+    self.embedGame, self.model = embedGame, model
+
+  def getPolicy(self, history):
+    states = self.embedGame(history, self.columns['state'])
+    prev_actions = self.embedPrevAction(history, self.columns['prev_action'])
+    history = np.concatenate([states, prev_actions], 1).reshape([-1])
+    return self.model.getPolicy(history)
+
+  def act_flat(self, history, hidden, verbose=False):
+    return self.model.act(self.getPolicy(history), verbose)
+
+def randomHistory(layout, frames):
+  history = np.empty([frames, layout.size], dtype=np.float32)
+  for i, (_, ctype, _) in enumerate(layout.leaves):
+    if ctype is ct.c_bool:
+      history[:, i] = random.randint(2, size=frames)
+    elif ctype is ct.c_uint:
+      # go past the one-hot sizes to check out of range values too
+      history[:, i] = random.randint(0x200, size=frames)
+    else:
+      history[:, i] = random.normal(scale=10., size=frames)
+  return history
+
+def check(trials=100, **kwargs):
+  """Checks the numpy policy against the tensorflow graph on random histories.
+
+  Both use the same freshly initialized weights, so no checkpoint is needed.
+  """
+  import RL
+  model = RL.Model(mode=RL.Mode.PLAY, **kwargs)
+  model.init()
+  policy = Policy(**kwargs)
+  policy.names = [v.name for v in model.trainable_variables]
+  policy.unblob(model.blob())
+
+  for _ in range(trials):
+    history = randomHistory(model.layout, model.memory+1)
+
+    expected = model.sess.run(model.policy, {model.flat_input: history})
+    actual = policy.getPolicy(history)
+
+    if model.model.__class__.__name__ == 'DQN':
+      expected = expected[1]
+      actual = actual[1]
+
+    error = np.max(np.abs(expected - actual))
+    if not np.allclose(expected, actual, rtol=1e-4, atol=1e-5):
+      raise AssertionError("numpy policy differs from tensorflow by %g" % error)
+
+  print("numpy and tensorflow policies agree on %d histories" % trials)
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+  parser = ArgumentParser()
+
+  for opt in model_options.Model.full_opts():
+    opt.update_parser(parser)
+
+  for model in model_options.models.values():
+    for opt in model.full_opts():
+      opt.update_parser(parser)
+
+  parser.add_argument("--trials", type=int, default=100)
+
+  args = parser.parse_args()
+  check(**{k: v for k, v in args.__dict__.items() if v is not None})
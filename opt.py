@@ -1,15 +1,11 @@
 import tensorflow as tf
 
 from default import *
+import model_options
 import natgrad
 
 class Optimizer(Default):
-  _options = [
-    Option('learning_rate', type=float, default=0.001),
-    Option('optimizer', type=str, default="GradientDescent", help="which tf.train optimizer to use"),
-    Option('natural', action="store_true", help="Use natural gradient."),
-    Option('clip', type=float, help="clip gradients above a certain value")
-  ]
+  _options = model_options.Optimizer._options
   
   _members = [
     ('natgrad', natgrad.NaturalGradient)
@@ -30,16 +26,19 @@ class Optimizer(Default):
     
     grads = [tf.check_numerics(g, "NaN gradient in param %d" % i) for i, g in enumerate(grads)]
     
-    flat_params, flat_grads = [tf.abs(tf.concat(0, [tf.reshape(t, [-1]) for t in ts])) for ts in (params, grads)]
+    # Per-tensor reductions rather than one flat concatenation of every gradient.
+    # The summaries are only computed on the steps that fetch them.
+    abs_grads = [tf.abs(g) for g in grads]
+    grad_max = tf.reduce_max(tf.pack([tf.reduce_max(g) for g in abs_grads]))
+    grad_sum = tf.add_n([tf.reduce_sum(g) for g in abs_grads])
+    grad_count = sum(p.get_shape().num_elements() for p in params)
     
     #flat_ratios = flat_grads / flat_params
     #tf.scalar_summary('grad_param_max', tf.reduce_max(flat_ratios))
     #tf.scalar_summary('grad_param_avg', tf.reduce_mean(flat_ratios))
     
-    grad_max = tf.reduce_max(flat_grads)
-    
     tf.scalar_summary('grad_max', grad_max)
-    tf.scalar_summary('grad_avg', tf.reduce_mean(flat_grads))
+    tf.scalar_summary('grad_avg', grad_sum / grad_count)
     
     if self.clip:
       clip = tf.minimum(self.clip, grad_max) / grad_max
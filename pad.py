@@ -27,9 +27,49 @@ class Stick(enum.Enum):
     MAIN = 0
     C = 1
 
+def controllerCommands(controller):
+    """Returns the (input, command) pairs that set the pad to controller."""
+    commands = []
+
+    for button in Button:
+        field = 'button_' + button.name
+        if hasattr(controller, field):
+            verb = 'PRESS' if getattr(controller, field) else 'RELEASE'
+            commands.append((button, '{} {}\n'.format(verb, button.name)))
+
+    # for trigger in Trigger:
+    #     field = 'trigger_' + trigger.name
+    #     commands.append((trigger, 'SET {} {:.2f}\n'.format(trigger.name, getattr(controller, field))))
+
+    for stick in Stick:
+        field = 'stick_' + stick.name
+        value = getattr(controller, field)
+        assert 0 <= value.x <= 1 and 0 <= value.y <= 1
+        commands.append((stick, 'SET {} {:.2f} {:.2f}\n'.format(stick.name, value.x, value.y)))
+
+    return commands
+
+class ActionTable:
+    """Pre-formatted pad commands for a fixed list of controller states.
+
+    full[i] sets every input to controllers[i], while deltas[i][j] only
+    contains the commands that differ when going from controllers[i] to j.
+    """
+    def __init__(self, controllers):
+        self.states = [dict(controllerCommands(c)) for c in controllers]
+        self.full = [''.join(state.values()) for state in self.states]
+        self.deltas = [
+            [''.join(command for input, command in dst.items() if src.get(input) != command) for dst in self.states]
+            for src in self.states
+        ]
+
 class Pad:
-    """Writes out controller inputs."""
-    def __init__(self, path):
+    """Writes out controller inputs.
+
+    With coalesce=True, commands are only written when they change an input,
+    and are held back until flush() so that each frame is a single write.
+    """
+    def __init__(self, path, coalesce=False):
         """Opens the fifo. Blocks until the other end is listening."""
         self.pipe = None
         try:
@@ -38,26 +78,54 @@ class Pad:
             pass
         self.pipe = open(path, 'w', buffering=1)
 
+        self.coalesce = coalesce
+        self.sent = {}
+        self.pending = []
+        # the last action sent with send_action, if nothing else was sent since
+        self.action = None
+
     def __del__(self):
         """Closes the fifo."""
         if self.pipe:
+            self.flush()
             self.pipe.close()
 
+    def write(self, input, command):
+        """Writes a command for input, or queues it if coalescing."""
+        if self.action is not None:
+            # sent may be shared with an ActionTable
+            self.sent = dict(self.sent)
+            self.action = None
+
+        if not self.coalesce:
+            self.pipe.write(command)
+            return
+
+        if self.sent.get(input) != command:
+            self.sent[input] = command
+            self.pending.append(command)
+
+    def flush(self):
+        """Sends all queued commands in one write."""
+        if self.pending:
+            self.pipe.write(''.join(self.pending))
+            self.pending = []
+
     def press_button(self, button):
         """Press a button."""
         assert button in Button
-        self.pipe.write('PRESS {}\n'.format(button.name))
+        self.write(button, 'PRESS {}\n'.format(button.name))
 
     def release_button(self, button):
         """Release a button."""
         assert button in Button
-        self.pipe.write('RELEASE {}\n'.format(button.name))
+        self.write(button, 'RELEASE {}\n'.format(button.name))
 
     def press_trigger(self, trigger, amount):
         """Press a trigger. Amount is in [0, 1], with 0 as released."""
         assert trigger in Trigger
         # assert 0 <= amount <= 1
-        self.pipe.write('SET {} {:.2f}\n'.format(trigger.name, amount))
+        self.write(trigger, 'SET {} {:.2f}\n'.format(trigger.name, amount))
 
     def tilt_stick(self, stick, x, y):
         """Tilt a stick. x and y are in [0, 1], with 0.5 as neutral."""
@@ -66,22 +134,26 @@ class Pad:
           assert 0 <= x <= 1 and 0 <= y <= 1
         except AssertionError:
           import ipdb; ipdb.set_trace()
-        self.pipe.write('SET {} {:.2f} {:.2f}\n'.format(stick.name, x, y))
+        self.write(stick, 'SET {} {:.2f} {:.2f}\n'.format(stick.name, x, y))
 
     def send_controller(self, controller):
-        for button in Button:
-            field = 'button_' + button.name
-            if hasattr(controller, field):
-                if getattr(controller, field):
-                    self.press_button(button)
-                else:
-                    self.release_button(button)
-
-        # for trigger in Trigger:
-        #     field = 'trigger_' + trigger.name
-        #     self.press_trigger(trigger, getattr(controller, field))
-
-        for stick in Stick:
-            field = 'stick_' + stick.name
-            value = getattr(controller, field)
-            self.tilt_stick(stick, value.x, value.y)
+        """Sends a controller state. See send_action for precomputed ones."""
+        for input, command in controllerCommands(controller):
+            self.write(input, command)
+
+    def send_action(self, table, action):
+        """Sends the controller state at index action in an ActionTable."""
+        if self.action is None:
+            command = table.full[action]
+        else:
+            command = table.deltas[self.action][action]
+
+        self.action = action
+        self.sent = table.states[action]
+
+        if not command:
+            return
+        if self.coalesce:
+            self.pending.append(command)
+        else:
+            self.pipe.write(command)
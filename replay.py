@@ -0,0 +1,153 @@
+"""
+Replay buffers for the trainer.
+
+Experiences are stored columnwise: each leaf of the experience dict gets one
+preallocated array of shape [capacity] + leaf shape. Pushing writes into those
+arrays in place, and sampling gathers a batch with fancy indexing, which is
+already in the stacked form that RL.Model.train feeds to tensorflow.
+"""
+
+import numpy as np
+from numpy import random
+import util
+
+class ReplayBuffer:
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.arrays = None # allocated on the first push, when the shapes are known
+    self.index = 0
+    self.count = 0
+
+  def allocate(self, experience):
+    def alloc(leaf):
+      leaf = np.asarray(leaf)
+      return np.zeros((self.capacity,) + leaf.shape, dtype=leaf.dtype)
+    self.arrays = util.deepMap(alloc, experience)
+
+  def push(self, experience):
+    """Copies an experience into the next slot, overwriting the oldest."""
+    if self.arrays is None:
+      self.allocate(experience)
+
+    for array, value in util.deepValues(util.deepZip(self.arrays, experience)):
+      array[self.index] = value
+
+    pushed = self.index
+    self.index = (self.index + 1) % self.capacity
+    self.count = min(self.count + 1, self.capacity)
+    return pushed
+
+  def __len__(self):
+    return self.count
+
+  def indices(self):
+    """The filled slots, oldest first."""
+    start = self.index if self.count == self.capacity else 0
+    return (start + np.arange(self.count)) % self.capacity
+
+  def gather(self, indices):
+    """A batch of the experiences at the given slots."""
+    return util.deepMap(lambda array: array[indices], self.arrays)
+
+  def sample(self, batch_size):
+    return self.gather(random.randint(self.count, size=batch_size))
+
+  def batches(self, batch_size, shuffle=True):
+    """One pass over the buffer in batches, like util.chunk over a shuffled list."""
+    indices = self.indices()
+    if shuffle:
+      random.shuffle(indices)
+    for batch in util.chunk(indices, batch_size):
+      yield self.gather(batch)
+
+  def nbytes(self):
+    return sum(array.nbytes for array in util.deepValues(self.arrays))
+
+class SumTree:
+  """Priorities in the leaves of a binary tree whose nodes hold the sum of their children.
+
+  Updating a priority and finding the leaf at a given prefix sum are both
+  O(log n); sample and update take whole arrays of indices at once.
+  """
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.leaves = 1
+    while self.leaves < capacity:
+      self.leaves *= 2
+    # node i has children 2i and 2i+1, the leaves start at self.leaves
+    self.nodes = np.zeros(2 * self.leaves)
+
+  def total(self):
+    return self.nodes[1]
+
+  def __getitem__(self, indices):
+    return self.nodes[self.leaves + np.asarray(indices)]
+
+  def update(self, indices, priorities):
+    nodes = self.leaves + np.asarray(indices)
+    self.nodes[nodes] = priorities
+
+    # parents of repeated indices are recomputed from their children, so duplicates are fine
+    while nodes[0] > 1:
+      nodes = np.unique(nodes // 2)
+      self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+  def find(self, values):
+    """The leaves at which the running sum of priorities passes each value."""
+    nodes = np.ones(len(values), dtype=np.int64)
+    values = np.array(values, dtype=np.float64)
+
+    while nodes[0] < self.leaves:
+      left = 2 * nodes
+      go_right = values >= self.nodes[left]
+      values -= np.where(go_right, self.nodes[left], 0)
+      nodes = left + go_right
+
+    # guard against rounding pushing us onto an empty leaf
+    return np.minimum(nodes - self.leaves, self.capacity - 1)
+
+  def sample(self, count):
+    """Stratified sample of count leaves, proportional to priority."""
+    bounds = np.linspace(0, self.total(), count + 1)
+    return self.find(random.uniform(bounds[:-1], bounds[1:]))
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+  """Samples experiences in proportion to priority ** alpha.
+
+  New experiences get the highest priority seen so far, so they are trained
+  on at least once. Sampling returns importance sampling weights that
+  correct for the non-uniform distribution, by an exponent beta that is
+  annealed linearly up to 1 over beta_steps samples (or fixed if beta_steps
+  is 0).
+  """
+  def __init__(self, capacity, alpha=0.6, beta=0.4, beta_steps=0, epsilon=1e-3):
+    ReplayBuffer.__init__(self, capacity)
+    self.alpha = alpha
+    self.beta = beta
+    self.beta_step = (1. - beta) / beta_steps if beta_steps else 0.
+    self.epsilon = epsilon
+    self.tree = SumTree(capacity)
+    self.max_priority = 1.
+
+  def push(self, experience):
+    pushed = ReplayBuffer.push(self, experience)
+    self.tree.update([pushed], [self.max_priority ** self.alpha])
+    return pushed
+
+  def sample(self, batch_size):
+    """Returns the slots sampled, the batch and its importance sampling weights."""
+    indices = self.tree.sample(batch_size)
+
+    probs = self.tree[indices] / self.tree.total()
+    weights = (self.count * probs) ** -self.beta
+    weights /= weights.max()
+
+    self.beta = min(self.beta + self.beta_step, 1.)
+
+    return indices, self.gather(indices), weights.astype(np.float32)
+
+  def update(self, indices, priorities):
+    """Sets the priorities (such as mean absolute TD errors) of sampled slots."""
+    priorities = np.abs(priorities) + self.epsilon
+    self.max_priority = max(self.max_priority, priorities.max())
+    self.tree.update(indices, priorities ** self.alpha)
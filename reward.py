@@ -24,14 +24,53 @@ def computeRewards(state_actions, enemies=[0], allies=[1], damage_ratio=0.01):
 
   return sum(losses[p] for p in enemies) - sum(losses[p] for p in allies)
 
-# TODO: unfinished
+def isDyingVectorized(action_states):
+  return action_states <= 0xA
+
+def processDeathsVectorized(deaths):
+  return np.logical_and(np.logical_not(deaths[:-1]), deaths[1:]).astype(float)
+
+def processDamagesVectorized(percents):
+  # percents are unsigned, so go signed before taking differences
+  return np.maximum(np.diff(percents.astype(np.int64)), 0)
+
 def computeRewards_vectorized(states, enemies=[0], allies=[1], damage_ratio=0.01):
+  """Same as computeRewards, but on the columns from ctype_util.viewCTypes.
+
+  states is the 'state' entry of a vectorized SimpleStateAction array.
+  """
   players = enemies + allies
 
-  deaths = {p : processDeaths(list(map(isDyingAction, states['players'][p]['action_state']))) for p in players}
-  damages = {p : processDamages([s.players[p].percent for s in states]) for p in players}
+  deaths = {p : processDeathsVectorized(isDyingVectorized(states['players'][p]['action_state'])) for p in players}
+  damages = {p : processDamagesVectorized(states['players'][p]['percent']) for p in players}
 
   losses = {p : deaths[p] + damage_ratio * damages[p] for p in players}
 
   return sum(losses[p] for p in enemies) - sum(losses[p] for p in allies)
 
+def benchmark(fps=20, seconds=[20, 40, 60]):
+  """Checks computeRewards_vectorized against computeRewards and times both."""
+  import timeit
+  import ssbm
+  import ctype_util as ct
+  from numpy import random
+
+  for s in seconds:
+    n = fps * s
+    state_actions = (n * ssbm.SimpleStateAction)()
+    states = ct.viewCTypes(ssbm.SimpleStateAction, state_actions)['state']
+    for p in [0, 1]:
+      player = states['players'][p]
+      player['action_state'][:] = random.choice([0x3, 0xE, 0x14], n)
+      player['percent'][:] = random.randint(0, 300, n)
+
+    expected = computeRewards(state_actions)
+    actual = computeRewards_vectorized(states)
+    assert np.array_equal(expected, actual)
+
+    t_loop = min(timeit.repeat(lambda: computeRewards(state_actions), number=1, repeat=5))
+    t_vec = min(timeit.repeat(lambda: computeRewards_vectorized(states), number=10, repeat=5)) / 10
+    print("%ds (%d frames): loop %.3fms, vectorized %.3fms" % (s, n, 1000 * t_loop, 1000 * t_vec))
+
+if __name__ == '__main__':
+  benchmark()
@@ -5,7 +5,7 @@ from argparse import ArgumentParser
 from multiprocessing import Process
 import random
 from cpu import CPU
-import RL
+import model_options
 import util
 
 parser = ArgumentParser()
@@ -13,7 +13,7 @@ parser = ArgumentParser()
 for opt in CPU.full_opts():
   opt.update_parser(parser)
 
-for model in RL.models.values():
+for model in model_options.models.values():
   for opt in model.full_opts():
     opt.update_parser(parser)
 
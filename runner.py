@@ -89,6 +89,9 @@ else:
 for k, v in train_settings:
   add_param(k, v, ['train'], False)
 
+# push weights to the agents instead of having them reload from disk
+#add_param('publish', True, ['train'], False)
+
 #add_param('action_space', 0, both)
 #add_param('player_space', 0, both, True)
 
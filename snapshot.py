@@ -0,0 +1,87 @@
+"""
+A raw snapshot format for model weights, quick to write and to load.
+
+The file is a header, a json index of (name, dtype, shape, offset) and then
+each array's raw bytes at an aligned offset. Loading memory-maps the file, so
+the arrays are read lazily, straight into whatever they're fed to.
+"""
+
+import os
+import json
+import struct
+import tempfile
+import numpy as np
+
+header = struct.Struct('<8sQ') # magic, index length
+magic = b'RAWW0001'
+alignment = 64
+
+def align(offset):
+  return -(-offset // alignment) * alignment
+
+def writeRaw(filename, blob):
+  """Writes a blob (as from RL.Model.blob) atomically."""
+  arrays = [(name, np.asarray(value, order='C')) for name, value in sorted(blob.items())]
+
+  # offsets depend on the index length, which depends on the offsets
+  offsets = [0] * len(arrays)
+  while True:
+    index = json.dumps([(name, a.dtype.str, a.shape, offset) for (name, a), offset in zip(arrays, offsets)]).encode()
+    offset = align(header.size + len(index))
+    new_offsets = []
+    for _, a in arrays:
+      new_offsets.append(offset)
+      offset = align(offset + a.nbytes)
+    if new_offsets == offsets:
+      break
+    offsets = new_offsets
+
+  directory = os.path.dirname(filename) or '.'
+  with tempfile.NamedTemporaryFile(dir=directory, delete=False) as f:
+    f.write(header.pack(magic, len(index)))
+    f.write(index)
+    for (_, a), offset in zip(arrays, offsets):
+      f.seek(offset)
+      f.write(a.tobytes())
+    f.truncate(align(f.tell()))
+  os.rename(f.name, filename)
+
+def loadRaw(filename):
+  """Returns the blob in a raw snapshot, as read-only views of a memory map."""
+  with open(filename, 'rb') as f:
+    magic_, length = header.unpack(f.read(header.size))
+    if magic_ != magic:
+      raise ValueError("%s is not a raw snapshot" % filename)
+    index = json.loads(f.read(length).decode())
+
+  data = np.memmap(filename, dtype=np.uint8, mode='r')
+
+  blob = {}
+  for name, dtype, shape, offset in index:
+    dtype = np.dtype(dtype)
+    size = dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+    blob[name] = data[offset:offset+size].view(dtype).reshape(shape)
+  return blob
+
+def rawVersions(path):
+  """The versioned raw snapshots in path, oldest written first."""
+  versions = []
+  for name in os.listdir(path):
+    if name.startswith("snapshot-") and name.endswith(".raw"):
+      versions.append((os.path.getmtime(path + name), int(name[len("snapshot-"):-len(".raw")]), path + name))
+  return [filename for _, _, filename in sorted(versions)]
+
+def latestSnapshot(path):
+  """Whether the tf checkpoint or the raw snapshot from RL.Model.write_blob is newer."""
+  def mtime(name):
+    try:
+      return os.path.getmtime(path + name)
+    except OSError:
+      return None
+  
+  raw = mtime("snapshot.raw")
+  checkpoint = mtime("checkpoint")
+  
+  if raw is not None and (checkpoint is None or raw >= checkpoint):
+    return 'raw'
+  return 'checkpoint'
@@ -2,13 +2,15 @@ from ctypes import *
 from ctype_util import *
 from enum import IntEnum
 import struct
+import sys
 import tempfile
 import os
-#import h5py
 import pickle
-from reward import computeRewards
+import zlib
+from reward import computeRewards_vectorized
 import numpy as np
 import itertools
+import pad
 
 @pretty_struct
 class Stick(Structure):
@@ -173,6 +175,9 @@ simpleControllerStates = [SimpleControllerState(button, stick) for button in Sim
 for i, c in enumerate(simpleControllerStates):
   c.index = i
 
+# pad commands for every action, and between every pair of actions
+actionTable = pad.ActionTable([c.realController() for c in simpleControllerStates])
+
 @pretty_struct
 class SimpleStateAction(Structure):
   _fields = [
@@ -205,14 +210,15 @@ def readStateActions(filename):
     return state_actions
 
 # prepares an experience for pickling
+# note that the columns are views into state_actions
 def prepareStateActions(state_actions):
-  vectorized = vectorizeCTypes(SimpleStateAction, state_actions)
+  vectorized = viewCTypes(SimpleStateAction, state_actions)
   
   #import ipdb; ipdb.set_trace()
   
   states = vectorized['state']
 
-  rewards = computeRewards(state_actions)
+  rewards = computeRewards_vectorized(states)
   
   vectorized['reward'] = rewards
   
@@ -229,21 +235,386 @@ def readStateActions_pickle(filename):
   with open(filename, 'rb') as f:
     return pickle.load(f)
 
-# TODO: replace pickle with hdf5
-def writeStateActions_HDF5(filename, state_actions):
-  with tempfile.NamedTemporaryFile(dir=os.path.dirname(filename), delete=False) as tf:
-    tf.write(intStruct.pack(len(state_actions)))
-    tf.write(state_actions)
-    tempname = tf.name
-  os.rename(tempname, filename)
+# HDF5 experience files (experimental - pickle is still the default, and
+# h5py is an optional dependency). The SimpleStateActions of all experiences
+# are concatenated in one chunked, compressed dataset of records, with the
+# same layout as in memory, alongside their rewards. The experiences dataset
+# records where each one starts and ends. Rewards are aligned with the frame
+# they follow, so the last frame of each experience has a meaningless (zero)
+# reward.
+
+hdf5Chunk = 1024
+
+def _importH5py():
+  try:
+    import h5py
+  except ImportError as err:
+    print("ImportError: {0}".format(err))
+    sys.exit("Install h5py to use the HDF5 experience files")
+  return h5py
+
+class HDF5Writer:
+  """Appends experiences to an HDF5 file.
+
+  The file stays open, and experiences are written batch at a time, as
+  every write to a dataset has a fixed cost. Call close (or use it in a
+  with block) to write out the rest.
+  """
+  def __init__(self, filename, append=True, compression='gzip', batch=16):
+    h5py = _importH5py()
+    self.file = h5py.File(filename, 'a' if append else 'w')
+    self.batch = batch
+    self.pending = []
+    
+    if 'experiences' not in self.file:
+      self.file.create_dataset('experiences', (0, 2), dtype=np.int64, maxshape=(None, 2))
+      self.file.create_dataset('records', (0,), dtype=toDType(SimpleStateAction), maxshape=(None,),
+        chunks=(hdf5Chunk,), compression=compression, shuffle=True)
+      self.file.create_dataset('reward', (0,), dtype=np.float64, maxshape=(None,),
+        chunks=(hdf5Chunk,), compression=compression, shuffle=True)
+  
+  def write(self, state_actions):
+    """Queues an experience, given as a ctypes or numpy array of SimpleStateActions."""
+    array = np.frombuffer(state_actions, dtype=toDType(SimpleStateAction))
+    rewards = np.zeros(len(array))
+    rewards[:-1] = computeRewards_vectorized(splitView(SimpleStateAction, array)['state'])
+    
+    # copied, as the caller may reuse state_actions
+    self.pending.append((array.copy(), rewards))
+    if len(self.pending) >= self.batch:
+      self.flush()
+  
+  def flush(self):
+    if not self.pending:
+      return
+    
+    experiences = self.file['experiences']
+    count = len(experiences)
+    start = int(experiences[count-1].sum()) if count else 0
+    
+    lengths = np.array([len(array) for array, _ in self.pending])
+    starts = start + np.cumsum(lengths) - lengths
+    end = start + lengths.sum()
+    
+    for name, column in [('records', 0), ('reward', 1)]:
+      dataset = self.file[name]
+      dataset.resize((end,))
+      dataset[start:end] = np.concatenate([item[column] for item in self.pending])
+    
+    experiences.resize((count + len(self.pending), 2))
+    experiences[count:] = np.stack([starts, lengths], 1)
+    
+    self.file.flush()
+    self.pending = []
+  
+  def close(self):
+    self.flush()
+    self.file.close()
+  
+  def __enter__(self):
+    return self
+  
+  def __exit__(self, *args):
+    self.close()
 
-def readStateActions_HDF5(filename):
-  with open(filename, 'rb') as f:
-    size = readInt(f)
-    state_actions = (size * SimpleStateAction)()
-    f.readinto(state_actions)
+def writeStateActions_HDF5(filename, state_actions, append=True, compression='gzip'):
+  """Appends a single experience to an HDF5 file, creating it if needed.
 
-    if len(f.read()) > 0:
-      raise Exception(filename + " too long!")
+  Use an HDF5Writer to write many.
+  """
+  with HDF5Writer(filename, append, compression) as writer:
+    writer.write(state_actions)
 
-    return state_actions
+def selected(name, fields):
+  return fields is None or any(name == f or name.startswith(f + '/') for f in fields)
+
+class HDF5Reader:
+  """Reads experiences from an HDF5 file, keeping it open."""
+  def __init__(self, filename):
+    h5py = _importH5py()
+    self.file = h5py.File(filename, 'r')
+  
+  def __len__(self):
+    return len(self.file['experiences'])
+  
+  def read(self, index=-1, fields=None):
+    """Reads one experience in the same form as prepareStateActions.
+
+    fields optionally restricts the result to some paths, such as
+    ['state/players/0', 'action', 'reward']. Leaves that weren't selected
+    are left out of structs and are None in arrays.
+    """
+    start, length = self.file['experiences'][index]
+    records = self.file['records'][start:start+length]
+    
+    def select(ctype, view, name):
+      if ctype in numpyCTypes:
+        return view if selected(name, fields) else None
+      elif issubclass(ctype, Structure):
+        struct = {}
+        for field, t in ctype._fields_:
+          value = select(t, view[field], name + '/' + field if name else field)
+          if value is not None:
+            struct[field] = value
+        return struct or None
+      else: # assume an array type
+        array = [select(ctype._type_, view[..., i], '%s/%d' % (name, i)) for i in range(ctype._length_)]
+        return array if any(x is not None for x in array) else None
+    
+    prepared = select(SimpleStateAction, records, '') or {}
+    
+    if selected('reward', fields):
+      prepared['reward'] = self.file['reward'][start:start+length-1]
+    
+    return prepared
+  
+  def close(self):
+    self.file.close()
+  
+  def __enter__(self):
+    return self
+  
+  def __exit__(self, *args):
+    self.close()
+
+def readStateActions_HDF5(filename, index=-1, fields=None):
+  """Reads a single experience, see HDF5Reader.read."""
+  with HDF5Reader(filename) as reader:
+    return reader.read(index, fields)
+
+def countStateActions_HDF5(filename):
+  with HDF5Reader(filename) as reader:
+    return len(reader)
+
+def benchmarkFiles(count=20, length=1200):
+  """Compares the pickle and HDF5 experience files."""
+  import time
+  import shutil
+  
+  state_actions = randomExperience(length)
+  directory = tempfile.mkdtemp()
+  
+  def size(path):
+    if os.path.isdir(path):
+      return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    return os.path.getsize(path)
+  
+  def writePickles(path):
+    os.makedirs(path)
+    for i in range(count):
+      writeStateActions_pickle(os.path.join(path, str(i)), state_actions)
+  
+  def readPickles(path):
+    for i in range(count):
+      readStateActions_pickle(os.path.join(path, str(i)))
+  
+  def writeHDF5(path):
+    with HDF5Writer(path) as writer:
+      for i in range(count):
+        writer.write(state_actions)
+  
+  def readHDF5(path):
+    with HDF5Reader(path) as reader:
+      for i in range(count):
+        reader.read(i)
+  
+  def readHDF5Action(path):
+    with HDF5Reader(path) as reader:
+      for i in range(count):
+        reader.read(i, fields=['action'])
+  
+  backends = [
+    ('pickle', writePickles, [('read', readPickles)]),
+    ('hdf5', writeHDF5, [('read', readHDF5), ('read action', readHDF5Action)]),
+  ]
+  
+  try:
+    for name, write, reads in backends:
+      path = os.path.join(directory, name)
+      
+      start = time.time()
+      write(path)
+      elapsed = time.time() - start
+      
+      total = size(path)
+      print("%s: %d bytes, write %.1f experiences/s" % (name, total, count / elapsed))
+      
+      for read_name, read in reads:
+        start = time.time()
+        read(path)
+        elapsed = time.time() - start
+        print("  %s %.1f experiences/s" % (read_name, count / elapsed))
+  finally:
+    shutil.rmtree(directory)
+
+# Binary experience transport. An experience is sent as three zmq frames:
+# a header, the pickled initial hidden state, and the SimpleStateAction
+# array. With the RAW codec the array is sent as is and the receiver views
+# it in place; with COMPRESSED it is encoded column by column.
+experienceHeader = struct.Struct('<4sIII') # magic, codec, frames, record size
+experienceMagic = b'SSA1'
+
+RAW = 0
+COMPRESSED = 1
+
+def encodeColumns(state_actions, level=1):
+  """Compresses a SimpleStateAction array field by field.
+
+  Bools are bit-packed, floats are xor-ed with the previous frame, and ints
+  are delta encoded in the narrowest width that fits. The result is zlib-ed.
+  """
+  array = np.frombuffer(state_actions, dtype=toDType(SimpleStateAction))
+  leaves = zip(leafFields(SimpleStateAction), leafViews(SimpleStateAction, array))
+  
+  widths = []
+  chunks = []
+  for (_, ctype, _), column in leaves:
+    if ctype is c_bool:
+      widths.append(0)
+      chunks.append(np.packbits(column))
+    elif ctype is c_float:
+      bits = np.ascontiguousarray(column).view(np.uint32)
+      widths.append(4)
+      chunks.append((bits ^ np.concatenate([[0], bits[:-1]]).astype(np.uint32)).astype('<u4'))
+    else:
+      values = column.astype(np.uint32)
+      deltas = (values - np.concatenate([[0], values[:-1]]).astype(np.uint32)).view(np.int32)
+      width = 4
+      for w in [1, 2]:
+        info = np.iinfo('i%d' % w)
+        if len(deltas) == 0 or (deltas.min() >= info.min and deltas.max() <= info.max):
+          width = w
+          break
+      widths.append(width)
+      chunks.append(deltas.astype('<i%d' % width))
+  
+  payload = bytes(bytearray(widths)) + b''.join(chunk.tobytes() for chunk in chunks)
+  return zlib.compress(payload, level)
+
+def decodeColumns(data, length):
+  """Inverse of encodeColumns, giving a SimpleStateAction-typed numpy array."""
+  payload = zlib.decompress(data)
+  array = np.zeros(length, dtype=toDType(SimpleStateAction))
+  
+  fields = list(leafFields(SimpleStateAction))
+  widths = bytearray(payload[:len(fields)])
+  offset = len(fields)
+  
+  for (_, ctype, _), width, column in zip(fields, widths, leafViews(SimpleStateAction, array)):
+    if width == 0:
+      size = (length + 7) // 8
+      column[:] = np.unpackbits(np.frombuffer(payload, np.uint8, size, offset))[:length]
+    elif ctype is c_float:
+      size = 4 * length
+      bits = np.bitwise_xor.accumulate(np.frombuffer(payload, '<u4', length, offset))
+      column[:] = bits.astype(np.uint32).view(np.float32)
+    else:
+      size = width * length
+      deltas = np.frombuffer(payload, '<i%d' % width, length, offset)
+      column[:] = np.cumsum(deltas, dtype=np.int64).astype(np.uint32)
+    offset += size
+  
+  return array
+
+def packExperience(state_actions, initial, codec=RAW):
+  """Returns the message frames for an experience.
+
+  With RAW the last frame is state_actions itself, so don't modify it after
+  a zero-copy send.
+  """
+  header = experienceHeader.pack(experienceMagic, codec, len(state_actions), sizeof(SimpleStateAction))
+  if codec == COMPRESSED:
+    data = encodeColumns(state_actions)
+  else:
+    data = state_actions
+  return [header, pickle.dumps(initial), data]
+
+def frameBuffer(frame):
+  # zmq.Frame when received with copy=False
+  return getattr(frame, 'buffer', frame)
+
+# what decoding a malformed or incompatible experience message can raise
+decodeErrors = (ValueError, IndexError, struct.error, zlib.error, pickle.UnpicklingError, EOFError)
+
+def decodeExperience(frames):
+  """Returns the states as a SimpleStateAction-typed numpy array, along with
+  the initial hidden state."""
+  magic, codec, length, itemsize = experienceHeader.unpack(frameBuffer(frames[0]))
+  if magic != experienceMagic or itemsize != sizeof(SimpleStateAction):
+    raise ValueError("Bad experience header %s" % ((magic, codec, length, itemsize),))
+  
+  if codec == RAW:
+    array = np.frombuffer(frameBuffer(frames[2]), dtype=toDType(SimpleStateAction), count=length)
+  elif codec == COMPRESSED:
+    array = decodeColumns(frameBuffer(frames[2]), length)
+  else:
+    raise ValueError("Unknown experience codec %d" % codec)
+  
+  return array, pickle.loads(frameBuffer(frames[1]))
+
+def prepareExperience(array, initial):
+  """Like prepareStateActions, but viewing a numpy array of SimpleStateActions."""
+  vectorized = splitView(SimpleStateAction, array)
+  vectorized['reward'] = computeRewards_vectorized(vectorized['state'])
+  vectorized['initial'] = initial
+  return vectorized
+
+def unpackExperience(frames):
+  """Turns received frames into the same dict as prepareStateActions.
+
+  A single frame is a pickled experience from send_pyobj. Otherwise the
+  header says how the states were encoded.
+  """
+  if len(frames) == 1:
+    return pickle.loads(frameBuffer(frames[0]))
+  
+  return prepareExperience(*decodeExperience(frames))
+
+def randomExperience(length):
+  """A vaguely realistic experience, for benchmarks."""
+  from numpy import random
+  
+  state_actions = (length * SimpleStateAction)()
+  columns = viewCTypes(SimpleStateAction, state_actions)
+  for player in columns['state']['players'][:2]:
+    player['x'][:] = np.cumsum(random.normal(size=length))
+    player['y'][:] = np.maximum(np.cumsum(random.normal(size=length)), 0)
+    player['percent'][:] = np.cumsum(random.binomial(1, 0.05, length) * random.randint(1, 15, length))
+    player['action_state'][:] = np.repeat(random.randint(0, 0x17E, length // 10 + 1), 10)[:length]
+    player['in_air'][:] = player['y'] > 0
+    player['character'][:] = 7
+  columns['action'][:] = np.repeat(random.randint(0, 54, length // 5 + 1), 5)[:length]
+  return state_actions
+
+def benchmarkTransport(length=1200, count=20):
+  """Compares the experience formats, without the network."""
+  import time
+  
+  state_actions = randomExperience(length)
+  
+  def pickled():
+    prepared = prepareStateActions(state_actions)
+    prepared['initial'] = []
+    return [pickle.dumps(prepared)]
+  
+  def binary():
+    frames = packExperience(state_actions, [])
+    # zmq sends the array's buffer as is
+    return frames[:2] + [memoryview(frames[2]).cast('B')]
+  
+  def compressed():
+    return packExperience(state_actions, [], COMPRESSED)
+  
+  for name, pack in [('pickle', pickled), ('binary', binary), ('compressed', compressed)]:
+    start = time.process_time()
+    for _ in range(count):
+      frames = pack()
+      unpackExperience(frames)
+    cpu = (time.process_time() - start) / count
+    
+    size = sum(len(memoryview(f).cast('B')) for f in frames)
+    print("%s: %d bytes, %.2fms cpu per experience, %.1f MB/s" % (name, size, 1000 * cpu, size / cpu / 1e6))
+
+if __name__ == '__main__':
+  benchmarkTransport()
+  benchmarkFiles()
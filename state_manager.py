@@ -1,5 +1,9 @@
 import struct
+import sys
+import functools
+import ctypes
 import attr
+import numpy as np
 import ssbm
 import fields
 
@@ -12,6 +16,7 @@ def generic_wrapper(value, wrapper, default):
     return value
 
 intStruct = struct.Struct('>i')
+uintStruct = struct.Struct('>I')
 
 byte_mask = 0xFF
 short_mask = 0xFFFF
@@ -66,7 +71,10 @@ def add_address(x, y):
 
 global_addresses = {}
 
-global_addresses['80479D60'] = Handler(['frame'], intHandler)
+# changes every frame
+frame_address = '80479D60'
+
+global_addresses[frame_address] = Handler(['frame'], intHandler)
 global_addresses['80479D30'] = Handler(['menu'], IntHandler(mask=byte_mask))#, Menu, Menu.Characters)
 global_addresses['804D6CAD'] = Handler(['stage'], shortHandler)#, Stage, Stage.Unselected)
 
@@ -209,3 +217,194 @@ class StateManager(object):
     def locations(self):
         """Returns a list of addresses for exporting to Locations.txt."""
         return self.addresses.keys()
+
+def flatHandlers(handlers):
+    return handlers if isinstance(handlers, list) else [handlers]
+
+# dolphin sends big-endian values; a byte reversal gives the native float
+reverseFloats = sys.byteorder == 'little'
+
+@attr.s
+class FieldOp(object):
+    """A Handler resolved to a raw field within a ctypes Structure."""
+    handler = attr.ib()
+    offset = attr.ib()
+    ctype = attr.ib()
+
+    def kind(self):
+        if getattr(self.handler, 'wrapper', None) is not None:
+            return 'generic'
+        if isinstance(self.handler, FloatHandler) and self.ctype is ctypes.c_float:
+            return 'float'
+        if isinstance(self.handler, IntHandler) and self.ctype in (ctypes.c_uint, ctypes.c_bool):
+            return 'int'
+        return 'generic'
+
+    def bind(self, obj, buf, path):
+        """Returns a function that applies a raw value directly to buf."""
+        kind = self.kind()
+        start = self.offset
+        end = start + ctypes.sizeof(self.ctype)
+
+        if kind == 'float':
+            if reverseFloats:
+                def op(value):
+                    buf[start:end] = value[::-1]
+            else:
+                def op(value):
+                    buf[start:end] = value
+            return op
+
+        if kind == 'int':
+            unpack = uintStruct.unpack
+            pack_into = struct.Struct(self.ctype._type_).pack_into
+            shift = self.handler.shift
+            mask = self.handler.mask
+
+            def op(value):
+                pack_into(buf, start, (unpack(value)[0] >> shift) & mask)
+            return op
+
+        return functools.partial(Handler(path, self.handler), obj)
+
+class CompiledStateManager(StateManager):
+    """A StateManager with a precompiled dispatch table.
+
+    Every address is assigned an integer id (its line in Locations.txt) and
+    every Handler path is resolved to a byte offset into ctype up front, so
+    handling a message is a table lookup plus a raw write into the struct.
+    """
+    def __init__(self, player_ids=range(4), ctype=ssbm.GameMemory):
+        StateManager.__init__(self, player_ids)
+        self.ctype = ctype
+
+        self.ids = {}
+        self.ops = []
+        self.paths = []
+
+        for address, handlers in self.addresses.items():
+            self.ids[address] = len(self.ops)
+            handlers = flatHandlers(handlers)
+            self.paths.append([h.path for h in handlers])
+            self.ops.append([FieldOp(h.handler, *fields.offsetPath(ctype, h.path)) for h in handlers])
+
+        self.compile_arrays()
+        self.obj = None
+
+    def compile_arrays(self):
+        """Flattens the ops into index arrays for handle_diffs.
+
+        Each vectorized kind gets parallel arrays of address ids, destinations,
+        shifts and masks. Ops that can't be expressed this way stay generic.
+        """
+        tables = {kind: [] for kind in ['float', 'uint', 'bool', 'generic']}
+
+        for address_id, ops in enumerate(self.ops):
+            for i, op in enumerate(ops):
+                kind = op.kind()
+                if kind == 'float' and op.offset % 4 == 0:
+                    tables['float'].append((address_id, op.offset // 4, 0, int_mask))
+                elif kind == 'int' and op.ctype is ctypes.c_uint and op.offset % 4 == 0:
+                    tables['uint'].append((address_id, op.offset // 4, op.handler.shift, op.handler.mask))
+                elif kind == 'int' and op.ctype is ctypes.c_bool:
+                    tables['bool'].append((address_id, op.offset, op.handler.shift, op.handler.mask))
+                else:
+                    tables['generic'].append((address_id, i))
+
+        def toArrays(table):
+            columns = zip(*table) if table else [[]] * 4
+            return tuple(np.array(c, dtype=np.intp if j < 2 else np.uint32) for j, c in enumerate(columns))
+
+        self.float_table = toArrays(tables['float'])
+        self.uint_table = toArrays(tables['uint'])
+        self.bool_table = toArrays(tables['bool'])
+        self.generic_ops = tables['generic']
+
+        self.latest = np.zeros(len(self.ops), dtype=np.uint32)
+        self.present = np.zeros(len(self.ops), dtype=bool)
+
+    def bind(self, obj):
+        """Builds the dispatch tables that write into obj."""
+        if not isinstance(obj, self.ctype):
+            raise TypeError("expected %s, got %s" % (self.ctype, type(obj)))
+
+        buf = memoryview(obj).cast('B')
+
+        self.dispatch_ids = [
+            tuple(op.bind(obj, buf, path) for op, path in zip(ops, paths))
+            for ops, paths in zip(self.ops, self.paths)
+        ]
+        self.dispatch = {address: self.dispatch_ids[i] for address, i in self.ids.items()}
+
+        self.words = np.frombuffer(obj, dtype=np.uint32)
+        self.bytes = np.frombuffer(obj, dtype=np.uint8)
+        self.obj = obj
+
+    def handle(self, obj, address, value):
+        """Convert the raw address and value into changes in the State."""
+        if obj is not self.obj:
+            self.bind(obj)
+        for op in self.dispatch[address]:
+            op(value)
+
+    # below this many changes, applying them one by one beats the fixed cost of the numpy ops
+    small_batch = 32
+
+    def handle_diffs(self, obj, diffs):
+        """Applies an array of memory_watcher.diffType records at once.
+
+        The work is a fixed number of numpy ops over the whole table, so it
+        doesn't grow with the number of changed addresses. Small batches go
+        through the per-address dispatch instead.
+        """
+        if obj is not self.obj:
+            self.bind(obj)
+
+        if len(diffs) < self.small_batch:
+            pack = uintStruct.pack
+            for address_id, value in zip(diffs['address'].tolist(), diffs['value'].tolist()):
+                for op in self.dispatch_ids[address_id]:
+                    op(pack(value))
+            return
+
+        latest = self.latest
+        present = self.present
+        present[:] = False
+        latest[diffs['address']] = diffs['value']
+        present[diffs['address']] = True
+
+        ids, words, _, _ = self.float_table
+        changed = present[ids]
+        self.words[words[changed]] = latest[ids[changed]]
+
+        ids, words, shifts, masks = self.uint_table
+        changed = present[ids]
+        self.words[words[changed]] = (latest[ids[changed]] >> shifts[changed]) & masks[changed]
+
+        ids, offsets, shifts, masks = self.bool_table
+        changed = present[ids]
+        self.bytes[offsets[changed]] = ((latest[ids[changed]] >> shifts[changed]) & masks[changed]) != 0
+
+        for address_id, i in self.generic_ops:
+            if present[address_id]:
+                self.dispatch_ids[address_id][i](uintStruct.pack(int(latest[address_id])))
+
+def benchmark(frames=10000):
+    import random
+    import timeit
+
+    managers = [('handlers', StateManager([0, 1])), ('compiled', CompiledStateManager([0, 1]))]
+    addresses = list(managers[0][1].locations())
+    messages = [(random.choice(addresses), struct.pack('>I', random.getrandbits(16))) for _ in range(frames)]
+
+    for name, sm in managers:
+        obj = ssbm.GameMemory()
+        def run():
+            for message in messages:
+                sm.handle(obj, *message)
+        run() # warm up
+        t = min(timeit.repeat(run, number=1, repeat=5))
+        print("%s: %.0f messages/sec" % (name, frames / t))
+
+if __name__ == '__main__':
+    benchmark()
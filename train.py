@@ -1,11 +1,17 @@
 import os
 import time
 import RL
+import ssbm
 import util
+import replay
+from experience_store import ExperienceStore
+import weights
 from default import *
 import numpy as np
 from collections import defaultdict
 from gc import get_objects
+from threading import Thread, Lock
+import queue
 import zmq
 
 # some helpers for debugging memory leaks
@@ -20,6 +26,96 @@ def diff_objects(after, before):
   diff = {k: after[k] - before[k] for k in after}
   return {k: i for k, i in diff.items() if i}
 
+def unpackExperience(frames, store=None):
+  """Like ssbm.unpackExperience, also appending binary experiences to the store."""
+  if store is None or len(frames) == 1:
+    return ssbm.unpackExperience(frames)
+  
+  array, initial = ssbm.decodeExperience(frames)
+  store.append(array, initial)
+  return ssbm.prepareExperience(array, initial)
+
+class ExperienceReceiver(Thread):
+  """Drains the experience socket in the background.
+  
+  Experiences are decoded on this thread and handed over through a bounded
+  queue. If the trainer falls behind, the oldest queued experiences are
+  dropped to make room. Messages that fail to decode are counted and skipped.
+  """
+  def __init__(self, context, address, size, store=None):
+    Thread.__init__(self, daemon=True)
+    
+    self.store = store
+    
+    # zmq sockets shouldn't be shared between threads, so this one is only used here
+    self.socket = context.socket(zmq.PULL)
+    self.socket.bind(address)
+    
+    self.queue = queue.Queue(size)
+    
+    self.received = 0
+    self.dropped = 0
+    self.errors = 0
+  
+  def run(self):
+    while True:
+      frames = self.socket.recv_multipart(copy=False)
+      try:
+        experience = unpackExperience(frames, self.store)
+      except ssbm.decodeErrors as err:
+        self.errors += 1
+        print("Bad experience message:", err)
+        continue
+      self.received += 1
+      
+      while True:
+        try:
+          self.queue.put_nowait(experience)
+          break
+        except queue.Full:
+          try:
+            self.queue.get_nowait()
+            self.dropped += 1
+          except queue.Empty:
+            pass
+  
+  def get(self, block=True):
+    return self.queue.get(block)
+  
+  def stats(self):
+    return dict(received=self.received, dropped=self.dropped, errors=self.errors, depth=self.queue.qsize())
+
+class Checkpointer(Thread):
+  """Writes snapshots of the model's variables in the background.
+  
+  If a snapshot is still pending when the next one comes in, it is replaced.
+  """
+  def __init__(self, model, keep):
+    Thread.__init__(self, daemon=True)
+    self.model = model
+    self.keep = keep
+    self.pending = queue.Queue(1)
+    self.written = 0
+    self.replaced = 0
+  
+  def save(self, blob, step):
+    while True:
+      try:
+        self.pending.put_nowait((blob, step))
+        return
+      except queue.Full:
+        try:
+          self.pending.get_nowait()
+          self.replaced += 1
+        except queue.Empty:
+          pass
+  
+  def run(self):
+    while True:
+      blob, step = self.pending.get()
+      self.model.write_blob(blob, step, self.keep)
+      self.written += 1
+
 class Trainer(Default):
   _options = [
     #Option("debug", action="store_true", help="set debug breakpoint"),
@@ -31,8 +127,25 @@ class Trainer(Default):
     Option("batch_size", type=int, default=1, help="number of trajectories per batch"),
     Option("batch_steps", type=int, default=1, help="number of gradient steps to take on each batch"),
     Option("min_collect", type=int, default=1, help="minimum number of experiences to collect between sweeps"),
+    
+    Option("prefetch", type=int, default=2, help="number of batches to prepare ahead on a background thread, 0 to disable"),
+    
+    Option("prioritized", action="store_true", help="sample batches by TD error instead of sweeping the buffer"),
+    Option("priority_alpha", type=float, default=0.6, help="how strongly priorities skew sampling, 0 is uniform"),
+    Option("priority_beta", type=float, default=0.4, help="initial importance sampling correction, 1 is full"),
+    Option("priority_beta_steps", type=int, default=0, help="anneal priority_beta up to 1 over this many batches, 0 keeps it fixed"),
 
     Option("dump", type=str, default="127.0.0.1", help="interface to listen on for experience dumps"),
+    Option("async_recv", type=bool, default=True, help="receive experiences on a background thread"),
+    Option("publish", type=bool, default=False, help="push weights to subscribed agents after every sweep"),
+    Option("weight_codec", type=str, default="int8", choices=weights.codecs.keys(), help="how to quantize the weight deltas sent between keyframes"),
+    Option("keyframe_every", type=int, default=10, help="send the full weights every N publishes"),
+    Option("store", type=str, help="directory of an on-disk experience store to append to and warm start from"),
+    Option("recv_queue", type=int, default=0, help="max experiences queued by the background receiver, defaults to the sweep size"),
+
+    Option("save_interval", type=float, default=0, help="minimum seconds between saves, checked after each sweep"),
+    Option("async_save", type=bool, default=True, help="write snapshots on a background thread"),
+    Option("keep", type=int, default=5, help="number of snapshots to keep when saving asynchronously"),
 
     Option("load", type=str, help="path to a json file from which to load params"),
   ]
@@ -60,58 +173,174 @@ class Trainer(Default):
     else:
       self.model.restore()
 
+    self.sweep_size = self.batches * self.batch_size
+    print("Sweep size", self.sweep_size)
+    
+    # the prefetch thread samples while the training thread updates priorities
+    self.buffer_lock = Lock()
+    
+    if self.prioritized:
+      self.buffer = replay.PrioritizedReplayBuffer(self.sweep_size, self.priority_alpha, self.priority_beta, self.priority_beta_steps)
+    else:
+      self.buffer = replay.ReplayBuffer(self.sweep_size)
+    
+    if self.store:
+      print("Experience store", self.store)
+      self.store = ExperienceStore(self.store, write=True)
+    
+    if self.async_save:
+      self.checkpointer = Checkpointer(self.model, self.keep)
+      self.checkpointer.start()
+    self.last_save = time.time()
+    
+    if self.publish:
+      self.publisher = weights.WeightPublisher(self.dump, self.model.name,
+        weights.codecs[self.weight_codec], self.keyframe_every)
+      self.publish_weights()
+    
     context = zmq.Context()
-
-    self.socket = context.socket(zmq.PULL)
+    
     sock_addr = "tcp://%s:%d" % (self.dump, util.port(self.model.name))
     print("Binding to " + sock_addr)
-    self.socket.bind(sock_addr)
-
-    self.sweep_size = self.batches * self.batch_size
-    print("Sweep size", self.sweep_size)
     
-    self.buffer = util.CircularQueue(self.sweep_size)
+    if self.async_recv:
+      self.receiver = ExperienceReceiver(context, sock_addr, self.recv_queue or self.sweep_size, self.store)
+      self.receiver.start()
+    else:
+      self.receiver = None
+      self.socket = context.socket(zmq.PULL)
+      self.socket.bind(sock_addr)
+  
+  def recv(self, block=True):
+    """Receives an experience, either pickled or in the binary format.
+    
+    Raises queue.Empty if block is False and nothing has arrived.
+    """
+    if self.receiver:
+      return self.receiver.get(block)
+    
+    while True:
+      try:
+        frames = self.socket.recv_multipart(0 if block else zmq.NOBLOCK, copy=False)
+      except zmq.Again:
+        raise queue.Empty
+      try:
+        return unpackExperience(frames, self.store)
+      except ssbm.decodeErrors as err:
+        print("Bad experience message:", err)
+  
+  def snapshot(self):
+    """The model's variables in host memory, and the global step."""
+    return self.model.blob(), int(self.model.sess.run(self.model.global_step))
+  
+  def save(self, blob, step):
+    if self.async_save:
+      self.checkpointer.save(blob, step)
+    else:
+      self.model.save()
+    self.last_save = time.time()
+  
+  def publish_weights(self, blob=None, step=None):
+    if blob is None:
+      blob, step = self.snapshot()
+    
+    # agents only play, so they don't need the optimizer state
+    needed = {v.name for v in self.model.trainable_variables}
+    needed.add(self.model.global_step.name)
+    
+    self.publisher.publish(step, {k: v for k, v in blob.items() if k in needed})
+  
+  def warm_start(self):
+    """Fills what it can of the buffer with the latest stored experiences."""
+    if not self.store:
+      return 0
+    
+    length = self.model.rlConfig.experience_length
+    indices = np.flatnonzero(self.store.index['length'] == length)
+    
+    for i in indices[-self.sweep_size:]:
+      self.buffer.push(self.store.experience(i))
+    
+    print("Warm started with %d stored experiences" % len(self.buffer))
+    return len(self.buffer)
+  
+  def feeds(self):
+    """Yields (slots, feed dict, prep time) for each batch in one round of sweeps."""
+    for _ in range(self.sweeps):
+      if self.prioritized:
+        # as many batches as a sweep, but weighted towards surprising experiences
+        for _ in range(self.batches):
+          start = time.time()
+          with self.buffer_lock:
+            indices, batch, weights = self.buffer.sample(self.batch_size)
+          yield indices, self.model.prepare(batch, weights), time.time() - start
+      else:
+        batches = self.buffer.batches(self.batch_size)
+        while True:
+          start = time.time()
+          batch = next(batches, None)
+          if batch is None:
+            break
+          yield None, self.model.prepare(batch), time.time() - start
   
   def train(self):
     before = count_objects()
     
     sweeps = 0
     
-    for _ in range(self.sweep_size):
-      self.buffer.push(self.socket.recv_pyobj())
+    for _ in range(self.sweep_size - self.warm_start()):
+      self.buffer.push(self.recv())
     
-    print("Buffer filled")
+    print("Buffer filled, %d bytes" % self.buffer.nbytes())
 
 
     while True:
       start_time = time.time()
       
       for _ in range(self.min_collect):
-        self.buffer.push(self.socket.recv_pyobj())
+        self.buffer.push(self.recv())
 
       collected = self.min_collect
       
       while True:
         try:
-          self.buffer.push(self.socket.recv_pyobj(zmq.NOBLOCK))
+          self.buffer.push(self.recv(block=False))
           collected += 1
-        except zmq.ZMQError as e:
+        except queue.Empty:
           break
       
       collect_time = time.time()
       
-      experiences = self.buffer.as_list()
+      timings = defaultdict(float)
+      steps = 0
       
-      for _ in range(self.sweeps):
-        from random import shuffle
-        shuffle(experiences)
+      wait_start = time.time()
+      for indices, input_dict, prep_time in util.prefetch(self.feeds(), self.prefetch):
+        run_start = time.time()
+        priorities = self.model.run(input_dict, self.batch_steps)
+        run_end = time.time()
         
-        for batch in util.chunk(experiences, self.batch_size):
-          self.model.train(batch, self.batch_steps)
+        if self.prioritized:
+          with self.buffer_lock:
+            self.buffer.update(indices, priorities)
+        
+        timings['prep'] += prep_time
+        timings['wait'] += run_start - wait_start
+        timings['run'] += run_end - run_start
+        timings['feed_mb'] += sum(np.asarray(v).nbytes for v in input_dict.values()) / 1e6
+        steps += 1
+        wait_start = time.time()
       
       train_time = time.time()
       
-      self.model.save()
+      if self.publish or time.time() - self.last_save >= self.save_interval:
+        blob, step = self.snapshot()
+        
+        if time.time() - self.last_save >= self.save_interval:
+          self.save(blob, step)
+        
+        if self.publish:
+          self.publish_weights(blob, step)
       
       save_time = time.time()
       
@@ -127,6 +356,14 @@ class Trainer(Default):
       collect_time -= start_time
       
       print(sweeps, self.sweep_size, collected, collect_time, train_time, save_time)
+      
+      if steps:
+        # prep runs on the prefetch thread; wait is how long training stalled on it.
+        # run includes copying the feed to the device as well as compute.
+        print("per step", {k: v / steps for k, v in timings.items()})
+      
+      if self.receiver:
+        print("receiver", self.receiver.stats())
 
 if __name__ == '__main__':
   from argparse import ArgumentParser
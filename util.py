@@ -2,6 +2,7 @@ from numpy import random
 import functools
 import operator
 from threading import Thread
+import queue
 import hashlib
 import os
 
@@ -106,6 +107,33 @@ def async_map(f, xs):
   
   return wait
 
+def prefetch(xs, size=1):
+  """Iterates over xs on a background thread, staying up to size items ahead."""
+  if size <= 0:
+    yield from xs
+    return
+  
+  q = queue.Queue(size)
+  done = object()
+  
+  def fill():
+    try:
+      for x in xs:
+        q.put((x, None))
+      q.put((done, None))
+    except Exception as e:
+      q.put((done, e))
+  
+  Thread(target=fill, daemon=True).start()
+  
+  while True:
+    x, error = q.get()
+    if error:
+      raise error
+    if x is done:
+      return
+    yield x
+
 def chunk(l, n):
   return [l[i:i+n] for i in range(0, len(l), n)]
 
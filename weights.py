@@ -0,0 +1,230 @@
+"""
+Pushes weights from the trainer to the agents over zmq PUB/SUB.
+
+A message is a header, a json index of the tensors it carries, and one frame
+per tensor. Keyframes (the RAW codec) hold every variable of an
+RL.Model.blob as is. In between, the other codecs send quantized deltas
+against the previous message, leaving out tensors that didn't change. The
+encoder tracks the weights as the agents will reconstruct them, so
+quantization error doesn't accumulate. PUB/SUB has no acknowledgements: an
+agent that misses a message ignores deltas until the next keyframe.
+"""
+
+import sys
+import json
+import struct
+from threading import Thread
+import numpy as np
+import util
+
+header = struct.Struct('<4sQQI') # magic, global step, base step, codec
+magic = b'WTS2'
+
+RAW = 0
+FLOAT16 = 1
+INT8 = 2
+
+codecs = dict(raw=RAW, float16=FLOAT16, int8=INT8)
+
+def port(name):
+  return util.port(name + "/weights")
+
+def frameBuffer(frame):
+  # zmq.Frame when received with copy=False
+  return getattr(frame, 'buffer', frame)
+
+def packMessage(step, base, codec, tensors):
+  """tensors is a list of (name, array, scale)."""
+  arrays = [np.asarray(array, order='C') for _, array, _ in tensors]
+  index = [(name, a.dtype.str, a.shape, scale) for (name, _, scale), a in zip(tensors, arrays)]
+  return [header.pack(magic, step, base, codec), json.dumps(index).encode()] + arrays
+
+def unpackMessage(frames):
+  """Returns the global step, base step, codec and list of (name, array, scale)."""
+  magic_, step, base, codec = header.unpack(frameBuffer(frames[0]))
+  if magic_ != magic:
+    raise ValueError("Bad weights header %s" % ((magic_, step, base, codec),))
+  if codec not in codecs.values():
+    raise ValueError("Unknown weights codec %d" % codec)
+
+  index = json.loads(bytes(frameBuffer(frames[1])).decode())
+  tensors = []
+  for (name, dtype, shape, scale), frame in zip(index, frames[2:]):
+    tensors.append((name, np.frombuffer(frameBuffer(frame), dtype=dtype).reshape(shape), scale))
+  return step, base, codec, tensors
+
+def isFloat(array):
+  return array.dtype.kind == 'f'
+
+def quantize(delta, codec):
+  """Returns the quantized delta, its scale, and what it dequantizes to."""
+  if codec == FLOAT16:
+    q = delta.astype(np.float16)
+    return q, None, q.astype(np.float32)
+
+  scale = float(np.max(np.abs(delta))) / 127 if delta.size else 0.
+  if scale == 0.:
+    return None, None, np.zeros_like(delta)
+  q = np.round(delta / scale).astype(np.int8)
+  return q, scale, q.astype(np.float32) * scale
+
+def dequantize(array, scale):
+  array = array.astype(np.float32)
+  return array if scale is None else array * scale
+
+class DeltaEncoder:
+  def __init__(self, codec=INT8, keyframe_every=10):
+    self.codec = codec
+    self.keyframe_every = keyframe_every
+    self.reference = None # the weights as reconstructed by the agents
+    self.step = None
+    self.count = 0
+
+  def encode(self, step, blob):
+    keyframe = self.codec == RAW or self.reference is None or self.count % self.keyframe_every == 0
+    self.count += 1
+
+    if keyframe:
+      self.reference = {name: np.array(value) for name, value in blob.items()}
+      self.step = step
+      return packMessage(step, step, RAW, [(name, value, None) for name, value in sorted(blob.items())])
+
+    tensors = []
+    for name, value in sorted(blob.items()):
+      value = np.asarray(value)
+      if not isFloat(value):
+        tensors.append((name, value, None))
+        self.reference[name] = np.array(value)
+        continue
+
+      q, scale, dequantized = quantize(value - self.reference[name], self.codec)
+      if q is None or not np.any(dequantized):
+        continue # unchanged, as far as the agents can tell
+      tensors.append((name, q, scale))
+      self.reference[name] = self.reference[name] + dequantized
+
+    frames = packMessage(step, self.step, self.codec, tensors)
+    self.step = step
+    return frames
+
+class DeltaDecoder:
+  def __init__(self):
+    self.weights = None
+    self.step = None
+
+  def decode(self, frames):
+    """Returns the full, updated blob, or None if this message can't be applied."""
+    step, base, codec, tensors = unpackMessage(frames)
+
+    if codec == RAW:
+      self.weights = {name: np.array(array) for name, array, _ in tensors}
+    elif self.weights is None or base != self.step:
+      return None # missed a message, wait for a keyframe
+    else:
+      # new arrays rather than in place updates, as the last blob may still be in use
+      weights = dict(self.weights)
+      for name, array, scale in tensors:
+        if isFloat(weights[name]):
+          weights[name] = weights[name] + dequantize(array, scale)
+        else:
+          weights[name] = np.array(array)
+      self.weights = weights
+
+    self.step = step
+    return self.weights
+
+def importZMQ():
+  try:
+    import zmq
+  except ImportError as err:
+    print("ImportError: {0}".format(err))
+    sys.exit("Install pyzmq to send weights")
+  return zmq
+
+class WeightPublisher:
+  def __init__(self, interface, name, codec=INT8, keyframe_every=10):
+    zmq = importZMQ()
+
+    context = zmq.Context()
+    self.socket = context.socket(zmq.PUB)
+    # slow agents should skip to the latest weights, not queue up old ones
+    self.socket.setsockopt(zmq.SNDHWM, 2)
+
+    address = "tcp://%s:%d" % (interface, port(name))
+    print("Publishing weights on " + address)
+    self.socket.bind(address)
+
+    self.encoder = DeltaEncoder(codec, keyframe_every)
+
+  def publish(self, step, blob):
+    self.socket.send_multipart(self.encoder.encode(step, blob), copy=False)
+
+class WeightSubscriber(Thread):
+  """Applies weights from a WeightPublisher in the background.
+
+  apply is called on this thread with each complete blob newer than the last.
+  """
+  def __init__(self, ip, name, apply):
+    Thread.__init__(self, daemon=True)
+    zmq = importZMQ()
+
+    context = zmq.Context()
+    self.socket = context.socket(zmq.SUB)
+    self.socket.setsockopt(zmq.SUBSCRIBE, b'')
+
+    address = "tcp://%s:%d" % (ip, port(name))
+    print("Subscribing to weights at " + address)
+    self.socket.connect(address)
+
+    self.apply = apply
+    self.decoder = DeltaDecoder()
+    self.step = -1
+    self.updates = 0
+    self.skipped = 0
+
+  def run(self):
+    while True:
+      frames = self.socket.recv_multipart(copy=False)
+      blob = self.decoder.decode(frames)
+      if blob is None:
+        self.skipped += 1
+      elif self.decoder.step > self.step:
+        self.apply(blob)
+        self.step = self.decoder.step
+        self.updates += 1
+
+def benchmark(updates=20, size=[512, 512], keyframe_every=10):
+  """Compares the codecs on a random walk of weights, without the network."""
+  import time
+  from numpy import random
+
+  blob = {'w:0': random.normal(size=size).astype(np.float32), 'global_step:0': np.array(0, dtype=np.int32)}
+  versions = []
+  for step in range(updates):
+    blob = dict(blob)
+    blob['w:0'] = blob['w:0'] + random.normal(scale=1e-3, size=size).astype(np.float32)
+    blob['global_step:0'] = np.array(step, dtype=np.int32)
+    versions.append(blob)
+
+  for name, codec in sorted(codecs.items()):
+    encoder = DeltaEncoder(codec, keyframe_every)
+    decoder = DeltaDecoder()
+
+    sent = 0
+    decode_time = 0.
+    error = 0.
+    for step, blob in enumerate(versions):
+      frames = encoder.encode(step, blob)
+      frames = frames[:2] + [memoryview(f).cast('B') for f in frames[2:]]
+      sent += sum(len(f) for f in frames)
+
+      start = time.time()
+      decoded = decoder.decode(frames)
+      decode_time += time.time() - start
+
+      error = max(error, float(np.max(np.abs(decoded['w:0'] - blob['w:0']))))
+
+    print("%s: %.1f KB per update, %.2fms to decode, max error %g" % (name, sent / updates / 1e3, 1e3 * decode_time / updates, error))
+
+if __name__ == '__main__':
+  benchmark()